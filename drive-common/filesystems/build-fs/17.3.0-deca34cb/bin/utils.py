@@ -8,11 +8,11 @@
 # distribution of this software and related documentation without an express
 # license agreement from NVIDIA CORPORATION or its affiliates is strictly prohibited.
 
+import functools
 import hashlib
 import os
+import shutil
 import sys
-from executor import Executor, PIPE
-from collections import OrderedDict
 import logging
 
 # Constants
@@ -22,10 +22,39 @@ MAGIC_MAP = {
     b"\x1f\x8b\x08": "gz",
     b"\xfd\x37\x7a\x58\x5A\x00": "xz"
 }
-MAGIC_MAP_OD = OrderedDict(sorted(MAGIC_MAP.items(), reverse=True))
-MAGIC_MAP_LEN = max(len(x) for x in MAGIC_MAP_OD)
-TEXT_CHARS = bytearray(
-                {7, 8, 9, 10, 12, 13, 27} | set(range(0x20, 0x100)) - {0x7f})
+MAGIC_MAP_LEN = max(len(x) for x in MAGIC_MAP)
+
+
+def _group_magics(magic_map):
+    """
+    Groups magics by their first byte, so a file is only compared against
+    the magics that can match. Longer magics are tried first, so a magic
+    that is a prefix of another does not shadow it.
+
+    Parameters
+    ----------
+    magic_map   : dict
+                  Magic bytes mapped to their file type.
+
+    Returns
+    -------
+    dict
+        First byte mapped to a list of (magic, filetype) tuples.
+    """
+    magics_by_first_byte = {}
+    for magic, filetype in sorted(magic_map.items(),
+                                  key=lambda x: -len(x[0])):
+        magics_by_first_byte.setdefault(magic[:1], []).append(
+            (magic, filetype))
+    return magics_by_first_byte
+
+
+MAGIC_MAP_BY_FIRST_BYTE = _group_magics(MAGIC_MAP)
+# Bytes deleted by is_text, as an immutable table built once at import
+TEXT_CHARS = bytes(
+                bytearray(sorted({7, 8, 9, 10, 12, 13, 27}
+                                 | set(range(0x20, 0x100)) - {0x7f})))
+MD5_CHUNK_SIZE = 1024 * 1024
 
 
 def md5(fname):
@@ -49,7 +78,10 @@ def md5(fname):
     hash_md5 = hashlib.md5()
     if not os.path.islink(fname) and os.path.lexists(fname):
         with open(fname, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            # hashlib.file_digest (Python 3.11+) hashes the file in C
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "md5").hexdigest()
+            for chunk in iter(lambda: f.read(MD5_CHUNK_SIZE), b""):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
     elif os.path.islink(fname):
@@ -95,15 +127,30 @@ def raise_error_and_exit(error, rc=1):
 
 def get_files_from_dir(directory):
     filelist = []
-    root = directory
-    for r, d, f in os.walk(directory):
-        for fil in f:
-            filelist += ["/" + os.path.normpath(os.path.join(
-                        os.path.relpath(r, root), fil))]
-        for fil in d:
-            if os.path.islink(os.path.join(r, fil)):
-                filelist += ["/" + os.path.normpath(os.path.join(
-                            os.path.relpath(r, root), fil))]
+    # Directories still to be listed, as (path relative to directory,
+    # absolute path) pairs. Subdirectories are pushed in reverse so they
+    # are listed in the same order as with os.walk.
+    stack = [("", directory)]
+    while stack:
+        rel, path = stack.pop()
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        files = []
+        dir_links = []
+        subdirs = []
+        with entries:
+            for entry in entries:
+                entry_rel = rel + "/" + entry.name
+                if not entry.is_dir():
+                    files.append(entry_rel)
+                elif entry.is_symlink():
+                    dir_links.append(entry_rel)
+                else:
+                    subdirs.append((entry_rel, entry.path))
+        filelist += files + dir_links
+        stack += reversed(subdirs)
 
     return filelist
 
@@ -112,17 +159,19 @@ def nv_abs_path(path):
     if path is None:
         raise RuntimeError(
                 "nv_abs_path: NoneType object passed as argument.")
-    return os.path.normpath(
-                os.path.join(
-                    os.path.realpath(
-                        os.path.dirname(path)),
-                    os.path.basename(path)))
+    parent = os.path.realpath(os.path.dirname(path))
+    basename = os.path.basename(path)
+    # realpath already returns a normalized path, so only a basename that
+    # is empty or a dot entry needs normalizing again
+    if basename in ("", ".", ".."):
+        return os.path.normpath(os.path.join(parent, basename))
+    return os.path.join(parent, basename)
 
 
 def get_file_ext(path):
     with open(path, "rb") as fd:
         content = fd.read(MAGIC_MAP_LEN)
-    for magic, filetype in MAGIC_MAP_OD.items():
+    for magic, filetype in MAGIC_MAP_BY_FIRST_BYTE.get(content[:1], ()):
         if content.startswith(magic):
             return filetype
     return None
@@ -132,12 +181,26 @@ def get_compression_tool(fil=None, comp=None):
     if fil is None and comp is None:
         raise RuntimeError(
                 "_get_compression_tool: Missing arguments to function")
-    compression_tools = None
     if fil:
         comp = str(get_file_ext(fil))
     comp = comp.strip('.')
     logging.debug("Compression of File {} is {}".format(
                     fil, comp))
+    tool = find_compression_tool(comp, os.environ.get("PATH"))
+    if tool is None:
+        raise RuntimeError(
+                "_get_compression_tool: No compression tool found")
+    return tool
+
+
+@functools.lru_cache(maxsize=None)
+def find_compression_tool(comp, path=None):
+    """
+    Returns the first compression tool for the given compression found in
+    path, or None. Results are cached, as the lookup only depends on the
+    compression and the search path.
+    """
+    compression_tools = None
     if comp == "gz":
         compression_tools = ["pigz", "gzip"]
     elif comp == "bz2":
@@ -146,19 +209,15 @@ def get_compression_tool(fil=None, comp=None):
         compression_tools = ["pixz", "xz"]
     if compression_tools:
         for tool in compression_tools:
-            rc = Executor.execute_on_host(
-                        'which', tool, exit_on_failure=False,
-                        silent=True, stdout=PIPE)["rc"]
-            if rc == 0:
+            if shutil.which(tool, path=path):
                 return tool
-    raise RuntimeError(
-            "_get_compression_tool: No compression tool found")
+    return None
 
 
 def is_text(path):
     try:
         with open(path, "rb") as fd:
-            return not bool(fd.read(1024).translate(None, TEXT_CHARS))
+            return not fd.read(1024).translate(None, TEXT_CHARS)
     except (IsADirectoryError, FileNotFoundError):
         return False
 
@@ -168,18 +227,29 @@ def deep_dict_update(d1, d2, list_action="replace"):
         raise_error_and_exit("deep_dict_update: Non dict update value.")
     if not isinstance(d1, dict):
         return d2
-    for k, v in d2.items():
-        if isinstance(v, dict):
-            d1[k] = deep_dict_update(d1.get(k, {}), v)
-        elif isinstance(v, list) and k in d1 and isinstance(d1[k], list):
-            if list_action == "replace":
-                d1[k] = v
-            elif list_action == "append":
-                d1[k] = d1[k] + v
+    # Nested dicts are merged from an explicit stack of (destination,
+    # source, list_action) entries. list_action only applies to the top
+    # level, nested lists are always replaced.
+    stack = [(d1, d2, list_action)]
+    while stack:
+        dst, src, action = stack.pop()
+        for k, v in src.items():
+            if isinstance(v, dict):
+                if k not in dst:
+                    dst[k] = {}
+                if isinstance(dst[k], dict):
+                    stack.append((dst[k], v, "replace"))
+                else:
+                    dst[k] = v
+            elif isinstance(v, list) and k in dst and isinstance(dst[k], list):
+                if action == "replace":
+                    dst[k] = v
+                elif action == "append":
+                    dst[k] = dst[k] + v
+                else:
+                    raise_error_and_exit(
+                        "deep_dict_update: Incorrect list_action value: "
+                        + action)
             else:
-                raise_error_and_exit(
-                    "deep_dict_update: Incorrect list_action value: "
-                    + list_action)
-        else:
-            d1[k] = v
+                dst[k] = v
     return d1
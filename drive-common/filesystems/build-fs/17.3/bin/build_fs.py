@@ -11,6 +11,7 @@
 # affiliates is strictly prohibited.
 
 import errno
+import functools
 import sys
 import os
 import json
@@ -19,19 +20,22 @@ import tempfile
 import shutil
 import atexit
 import shlex
+import stat
 import math
 import re
 import logging
 from utils import (md5, raise_error_and_exit, get_compression_tool, is_text,
                    deep_dict_update)
 from executor import Executor
-import gzip
 from copy import copy
-from collections import OrderedDict
-from distutils.version import LooseVersion
-from optparse import OptionParser
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from argparse import ArgumentParser
 from subprocess import PIPE
-import importlib.util
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # ==============================
 # Tool Dependencies and Versions
@@ -87,7 +91,7 @@ RESOLV_CONF = "/etc/resolv.conf"
 TMPDIR = "/tmp/"
 LINUX_ROOTFS_MANIFEST_DIR = "/etc/nvidia/rootfilesystem-manifest/"
 LINUX_ROOTFS_MANIFEST_LINK = "driveos-rfs.MANIFEST.json"
-EXT_DATA = [
+EXT_DATA = (
     (1, 65536, 2097151, "floppy", 4096, 8192, 128, 0),
     (2, 2097152, 3145727, "floppy", 4096, 8192, 128, 1024),
     (3, 3145728, 33554431, "small", 4096, 4096, 128, 1024),
@@ -99,8 +103,11 @@ EXT_DATA = [
     (9, 4294967296, 4398046511103, "default", 4096, 16384, 256, 32768),
     (10, 4398046511104, 17592186044415, "big", 4096, 32768, 256, 32768),
     (11, 17592186044416, -1, "huge", 4096, 65536, 256, 32768),
-]
+)
 EXT_BACKWARDS_COMPAT_OPT = " -O ^metadata_csum "
+# e2fsprogs versions newer than this need EXT_BACKWARDS_COMPAT_OPT
+E2FSPROGS_COMPAT_VERSION = (1, 43)
+E2FSPROGS_VERSION_REGEX = re.compile(rb"version\s*([0-9.]*)")
 SYS_UID_MIN, SYS_UID_MAX = 1, 999
 SYS_GID_MIN, SYS_GID_MAX = 1, 999
 
@@ -198,7 +205,7 @@ class Environment:
         """
         with open(file_path, 'r', encoding='utf-8') as f:
             try:
-                jsondata = json.load(f, object_pairs_hook=OrderedDict)
+                jsondata = json.load(f)
             except ValueError as error:
                 logging.error(error)
                 raise_error_and_exit(
@@ -242,8 +249,8 @@ class BuildFS:
 
         Parameters
         ----------
-        options     : Values
-                      Values class is from optparse module.
+        options     : Namespace
+                      Namespace class is from argparse module.
                       Controls workflow of Build-FS.
                       Obtained from function build_fs.define_options.
         json_file   : str
@@ -419,8 +426,8 @@ class LinuxBuildFS(BuildFS):
 
         Parameters
         ----------
-        options         : Values
-                          Values class is from optparse module.
+        options         : Namespace
+                          Namespace class is from argparse module.
                           Controls workflow of Build-FS.
                           Obtained from function build_fs.define_options.
         json_file       : str
@@ -616,15 +623,21 @@ class LinuxBuildFS(BuildFS):
 
     def process_output(self):
         """Execute Process-Output steps."""
-        if self.options.create_tar == "yes":
-            self.rfs_ops.compress_rootfs()
-        if self.options.create_image == "yes":
-            filesystem_blks = ExtImage.get_blocks(
-                    self.filesystem_work_dir,
-                    self.image.block_size)
-            self.image.tree_blocks = filesystem_blks
-            self.image.create_image()
-            self.rfs_ops.copy_to_image()
+        # The tarball and the image only read the filesystem work directory,
+        # so the tarball is compressed while the image is being created.
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            compress_future = None
+            if self.options.create_tar == "yes":
+                compress_future = pool.submit(self.rfs_ops.compress_rootfs)
+            if self.options.create_image == "yes":
+                filesystem_blks = ExtImage.get_blocks(
+                        self.filesystem_work_dir,
+                        self.image.block_size)
+                self.image.tree_blocks = filesystem_blks
+                self.image.create_image()
+                self.rfs_ops.copy_to_image()
+            if compress_future is not None:
+                compress_future.result()
         # For creating empty image
         if os.path.exists(self.filesystem_work_dir + SOURCES_LIST):
             output = self.deb_manager.get_full_debian_manifest(
@@ -801,8 +814,8 @@ class QNXBuildFS(BuildFS):
 
         Parameters
         ----------
-        options         : Values
-                          Values class is from optparse module.
+        options         : Namespace
+                          Namespace class is from argparse module.
                           Controls workflow of Build-FS.
                           Obtained from function build_fs.define_options.
         json_file       : str
@@ -1804,8 +1817,7 @@ class CopyTargetExecutor:
                     f.write('\n')
             return
         global COPYTARGET
-        if Environment.get('COPYTARGET'):
-            COPYTARGET = Environment.get('COPYTARGET')
+        COPYTARGET = Environment.get('COPYTARGET') or COPYTARGET
         if Environment.get('PYTHON3'):
             PYTHON3 = Environment.get('PYTHON3')
 
@@ -2284,7 +2296,7 @@ class LinuxRootfsOperations(RootfsOperations):
 
         with open(apt_src_list, 'w', encoding='utf-8') as fd_apt_src:
             for ln in self.mirror_uris:
-                if type(ln) is not OrderedDict:
+                if isinstance(ln, str):
                     fd_apt_src.write(ln + "\n")
                 else:
                     if ln['Type'] == "debian_mirror":
@@ -2588,25 +2600,21 @@ class LinuxRootfsOperations(RootfsOperations):
         # dpkg-scanpackages lists the file names in Packages relatively
         # to the dpkg-scanpackages execution directory.
         # Patching the filenames to the base-names.
-        with open(os.path.join(host_mirror_path, "Packages"),
-                  'w', encoding='utf-8') as f:
-            # remove the Packages' file paths and add a leading "./"
-            output = output.replace(filesystem_work_dir, "")
-            output = output.replace(target_mirror_path, "./")
-            f.write(output)
-
-        # Zip Packages t oPackages.gz.
-        with open(packages_file_name, 'rb') as f_in:
-            with gzip.open(packages_file_name + ".gz", 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        # remove the Packages' file paths and add a leading "./"
+        output = output.replace(filesystem_work_dir, "")
+        output = output.replace(target_mirror_path, "./")
+
+        # Only Packages.gz is kept in the mirror, so compress the patched
+        # output directly instead of round-tripping through Packages.
+        import gzip
+        with gzip.open(packages_file_name + ".gz", 'wt',
+                       encoding='utf-8') as f_out:
+            f_out.write(output)
 
         if not os.path.exists(packages_file_name + ".gz"):
             raise_error_and_exit(packages_file_name +
                                  ".gz could not be created ...")
 
-        # Remove the uncompressed Packages.
-        os.remove(packages_file_name)
-
         sources_list = "\ndeb [trusted=yes] file://" + \
                        target_mirror_path + " ./\n"
         return sources_list
@@ -2743,14 +2751,20 @@ class LinuxRootfsOperations(RootfsOperations):
                             with open(
                                 host_installer_deban_sources_list,
                                     'w', encoding='utf-8') as fd_inst_deb_src:
-                                rlines = fd_inst_deb_src_del.readlines()
-                                for line in rlines:
-                                    line = " ".join(line.split())
-                                    line = \
-                                        line.replace("deb file",
-                                                     "deb [trusted=yes] file")
-                                    fd_inst_deb_src.write(line)
-                                    sources_list += line + "\n"
+                                # Collapse whitespace runs and trim each line
+                                # in one pass over the whole file.
+                                content = re.sub(
+                                    r"[^\S\n]+", " ",
+                                    fd_inst_deb_src_del.read())
+                                content = re.sub(r"^ | $", "", content,
+                                                 flags=re.MULTILINE)
+                                content = \
+                                    content.replace("deb file",
+                                                    "deb [trusted=yes] file")
+                                if content and not content.endswith("\n"):
+                                    content += "\n"
+                                fd_inst_deb_src.write(content)
+                                sources_list += content
                         os.remove(host_installer_deban_sources_list_delete)
                         break
 
@@ -2863,6 +2877,7 @@ class LinuxRootfsOperations(RootfsOperations):
 
 
 class FSLeasedSpace:
+    depends_version_regex = re.compile(r"\([^()]*\)")
 
     def __init__(self, size_limits_file, build_fs):
         self.target_size_file = (
@@ -2885,8 +2900,9 @@ class FSLeasedSpace:
             return
 
         global COPYTARGET
-        if Environment.get('COPYTARGET'):
-            COPYTARGET = Environment.get('COPYTARGET')
+        COPYTARGET = Environment.get('COPYTARGET') or COPYTARGET
+        # CopyTarget is only needed when size records are requested
+        import importlib.util
         spec = importlib.util.spec_from_file_location("copytarget",
                                                       COPYTARGET)
         self.copytarget = importlib.util.module_from_spec(spec)
@@ -2897,6 +2913,10 @@ class FSLeasedSpace:
         self.file_records_dict = self.file_size_records.fileRecordsDict
 
         self.acceptable_units = ["bytes", "byte", "B"]
+        # Matches the first number in a value ending with an acceptable unit
+        self.value_regex = re.compile(
+            r"\D*(\d+).*(?:{})\Z".format(
+                "|".join(map(re.escape, self.acceptable_units))), re.DOTALL)
         self.include_debian_files = False
 
     def change_target_size_file(self, targetSizeFile):
@@ -2997,42 +3017,10 @@ class FSLeasedSpace:
             logging.info("'{}' module consumes '{}' bytes in the '{}' "
                          "filesystem."
                          .format(module, module_size, filesystem))
-            if module not in size_limits_dict["modules"]:
-                self.raise_issue("The max size of '{}' module is not defined "
-                                 "in {}."
-                                 .format(module, self.size_limits_file))
+            max_module_size = self.getModuleSizeLimit(size_limits_dict,
+                                                      module, filesystem)
+            if max_module_size is None:
                 return
-            if isinstance(size_limits_dict["modules"][module], dict):
-                if (filesystem not in size_limits_dict["modules"][module] and
-                        "others" not in size_limits_dict["modules"][module]):
-                    self.raise_issue("The max size of '{}' module for '{}' "
-                                     "filesystem is not defined in {}."
-                                     .format(module, filesystem,
-                                             self.size_limits_file))
-                    return
-                if filesystem in size_limits_dict["modules"][module]:
-                    max_module_size = size_limits_dict[
-                        "modules"][module][filesystem]
-                else:
-                    max_module_size = size_limits_dict[
-                        "modules"][module]["others"]
-            else:
-                max_module_size = size_limits_dict["modules"][module]
-            if self.uses_base:
-                # Ensure that only the size of a module in current layer
-                # (without the size of base image is specified in the manifest)
-                if not str(max_module_size).startswith("+"):
-                    self.raise_issue("'{}' filesystem uses '{}' as the base. "
-                                     "In such cases, the {} size limits file "
-                                     "should only specify the sizes of '{}' "
-                                     "module in current layer. "
-                                     "Such fields should start with a '+' "
-                                     "(e.g +512 bytes)"
-                                     .format(filesystem, self.base_file,
-                                             self.size_limits_file,
-                                             module))
-                    return
-            max_module_size = self.getIntValue(max_module_size)
             file_size_dict["modules"][
                     module]["moduleSizeLimit"] = max_module_size
             if module_size > max_module_size:
@@ -3047,82 +3035,171 @@ class FSLeasedSpace:
                              .format(max_module_size))
         file_size_records.writeTargetSizeManifest()
 
+    def getModuleSizeLimit(self, size_limits_dict, module, filesystem):
+        if module not in size_limits_dict["modules"]:
+            self.raise_issue("The max size of '{}' module is not defined "
+                             "in {}."
+                             .format(module, self.size_limits_file))
+            return None
+        if isinstance(size_limits_dict["modules"][module], dict):
+            if (filesystem not in size_limits_dict["modules"][module] and
+                    "others" not in size_limits_dict["modules"][module]):
+                self.raise_issue("The max size of '{}' module for '{}' "
+                                 "filesystem is not defined in {}."
+                                 .format(module, filesystem,
+                                         self.size_limits_file))
+                return None
+            if filesystem in size_limits_dict["modules"][module]:
+                max_module_size = size_limits_dict[
+                    "modules"][module][filesystem]
+            else:
+                max_module_size = size_limits_dict[
+                    "modules"][module]["others"]
+        else:
+            max_module_size = size_limits_dict["modules"][module]
+        if self.uses_base:
+            # Ensure that only the size of a module in current layer
+            # (without the size of base image is specified in the manifest)
+            if not str(max_module_size).startswith("+"):
+                self.raise_issue("'{}' filesystem uses '{}' as the base. "
+                                 "In such cases, the {} size limits file "
+                                 "should only specify the sizes of '{}' "
+                                 "module in current layer. "
+                                 "Such fields should start with a '+' "
+                                 "(e.g +512 bytes)"
+                                 .format(filesystem, self.base_file,
+                                         self.size_limits_file,
+                                         module))
+                return None
+        return self.getIntValue(max_module_size)
+
     def processDebianPackageManifest(self, manifest, debian_module):
         logging.info("Processing debian package size information")
-        packageManifestDict = OrderedDict()
+        packageManifestDict = {}
         with open(manifest, "r", encoding='utf-8') as manifestHandle:
             packageManifestDict = self.file_size_records.orderedYAMLLoad(
-                manifestHandle, Loader=yaml.SafeLoader)
-        # Determine the owners for all debians in the manifest
-        for debian in debian_module.copy():
+                manifestHandle, Loader=SafeLoader)
+        self.depends_cache = {}
+        # Debian file lists overlap, so each path is only normalized and
+        # stat'ed once per manifest. Paths that are not counted are cached
+        # as None.
+        self.source_path_cache = {}
+        self.file_size_cache = {}
+        # Determine the owners for all debians in the manifest. This has to
+        # finish before any package is added, as a package only gets its
+        # owner from whichever owned package depends on it.
+        for debian in list(debian_module):
             self.updateDependsModule(debian, debian_module,
                                      packageManifestDict)
-        for package in packageManifestDict["installed_packages"]:
-            if self.uses_base:
-                # Ignore packages that were already installed in the base FS
-                if package in packageManifestDict["base_packages"]:
-                    continue
+        base_packages = frozenset()
+        if self.uses_base:
+            base_packages = frozenset(
+                packageManifestDict.get("base_packages") or ())
+        installed_packages = packageManifestDict["installed_packages"]
+        for package, package_info in installed_packages.items():
+            # Ignore packages that were already installed in the base FS
+            if package in base_packages:
+                continue
             if package not in debian_module:
                 debian_module[package] = "unknown"
             self.addDebianPackage(package, debian_module[package],
-                                  packageManifestDict[
-                                      "installed_packages"][package]["size"],
-                                  packageManifestDict[
-                                      "installed_packages"][package]["files"])
+                                  package_info["size"],
+                                  package_info["files"])
         logging.info("Writing debian package size information to {}"
                      .format(self.target_size_file))
         self.file_size_records.writeTargetSizeManifest()
 
     def updateDependsModule(self, debian, debian_module, packageManifestDict):
-        if debian not in packageManifestDict["installed_packages"]:
-            # This can happen in case of optional dependencies
-            debian_module[debian] = "unknown"
-            return
-        depends = packageManifestDict["installed_packages"][debian]["depends"]
-        if depends is None:
-            return
-        depends = re.sub(r"\s+", "", depends)  # remove all white space
-        depends = re.sub(r"\|", ",", depends)  # Replace | with a ,
-        # Remove everything in brackets
-        depends = re.sub(r"\([^()]*\)", "", depends)
-        depends = depends.split(",")
-        for dependent in depends:
-            if dependent in debian_module:
+        installed_packages = packageManifestDict["installed_packages"]
+        # Walk the dependency graph with a worklist instead of recursing, so
+        # deep dependency chains cannot hit the interpreter recursion limit.
+        worklist = deque([debian])
+        while worklist:
+            package = worklist.popleft()
+            if package not in installed_packages:
+                # This can happen in case of optional dependencies
+                debian_module[package] = "unknown"
                 continue
-            else:
-                debian_module[dependent] = debian_module[debian]
-                self.updateDependsModule(dependent, debian_module,
-                                         packageManifestDict)
+            for dependent in self.getDependsList(package, installed_packages):
+                if dependent in debian_module:
+                    continue
+                debian_module[dependent] = debian_module[package]
+                worklist.append(dependent)
+
+    def getDependsList(self, debian, installed_packages):
+        # Depends strings are parsed once per manifest and reused when the
+        # same package is reached from several owners.
+        if debian in self.depends_cache:
+            return self.depends_cache[debian]
+        depends = installed_packages[debian]["depends"]
+        if depends is None:
+            depends = []
+        else:
+            # Remove all white space and everything in brackets, then
+            # replace | with a ,
+            depends = self.depends_version_regex.sub(
+                "", "".join(depends.split())).replace("|", ",")
+            depends = depends.split(",")
+        self.depends_cache[debian] = depends
+        return depends
+
+    @staticmethod
+    def getFileSize(source):
+        try:
+            lstat = os.lstat(source)
+        except OSError:
+            return None
+        # Symlinks are only counted when they point to a file
+        if stat.S_ISLNK(lstat.st_mode):
+            if not os.path.isfile(source):
+                return None
+        elif not stat.S_ISREG(lstat.st_mode):
+            return None
+        return lstat.st_size
 
     def addDebianPackage(self, debian, module, size, fileList):
-        if module not in self.file_size_dict["modules"]:
-            self.file_size_dict["modules"][module] = OrderedDict()
-            self.file_size_dict["modules"][module]["moduleSize"] = 0
-            self.file_size_dict[
-                    "modules"][module]["moduleSizeLimit"] = "unknown"
-            self.file_size_dict["modules"][module]["numberOfFiles"] = 0
-            self.file_size_dict["modules"][module]["numberOfDebians"] = 0
-            self.file_size_dict["modules"][module]["debians"] = OrderedDict()
-            self.file_size_dict["modules"][module]["files"] = OrderedDict()
+        modules = self.file_size_dict["modules"]
+        if module not in modules:
+            modules[module] = {
+                "moduleSize": 0,
+                "moduleSizeLimit": "unknown",
+                "numberOfFiles": 0,
+                "numberOfDebians": 0,
+                "debians": {},
+                "files": {},
+            }
+        moduleDict = modules[module]
 
         debianFileSize = 0
+        # Records are collected locally and merged once after the loop
+        debianFiles = {}
         if (size is None) or self.include_debian_files:
             for file in fileList:
-                source = self.copytarget.CopyTarget.normpath(
-                    self.build_fs.filesystem_work_dir + str(file))
-                if not os.path.isfile(source):
+                file = str(file)
+                source = self.source_path_cache.get(file)
+                if source is None:
+                    source = self.copytarget.CopyTarget.normpath(
+                        self.build_fs.filesystem_work_dir + file)
+                    self.source_path_cache[file] = source
+                if source in self.file_size_cache:
+                    fileSize = self.file_size_cache[source]
+                else:
+                    fileSize = self.getFileSize(source)
+                    self.file_size_cache[source] = fileSize
+                if fileSize is None:
                     continue
-                fileSize = os.lstat(source).st_size
                 debianFileSize += fileSize
                 if self.include_debian_files:
-                    if source not in self.file_records_dict:
+                    if (source not in self.file_records_dict and
+                            source not in debianFiles):
                         self.file_size_dict["totalNumberOfFiles"] += 1
-                        self.file_size_dict[
-                            "modules"][module]["numberOfFiles"] += 1
-                    self.file_size_dict[
-                        "modules"][module]["files"][source] = fileSize
-                    self.file_records_dict[source] = {"module": module,
-                                                      "size": fileSize}
+                        moduleDict["numberOfFiles"] += 1
+                    debianFiles[source] = fileSize
+        if debianFiles:
+            moduleDict["files"].update(debianFiles)
+            self.file_records_dict.update(
+                (source, {"module": module, "size": fileSize})
+                for source, fileSize in debianFiles.items())
 
         if size is not None:
             size = int(size) * 1024
@@ -3135,25 +3212,21 @@ class FSLeasedSpace:
         if "totalNumberOfDebians" not in self.file_size_dict:
             self.file_size_dict["totalNumberOfDebians"] = 0
         self.file_size_dict["totalNumberOfDebians"] += 1
-        self.file_size_dict["modules"][module]["moduleSize"] += size
-        if "numberOfDebians" not in self.file_size_dict["modules"][module]:
-            self.file_size_dict["modules"][module]["numberOfDebians"] = 0
-        self.file_size_dict["modules"][module]["numberOfDebians"] += 1
-        self.file_size_dict["modules"][module]["debians"][debian] = size
+        moduleDict["moduleSize"] += size
+        if "numberOfDebians" not in moduleDict:
+            moduleDict["numberOfDebians"] = 0
+        moduleDict["numberOfDebians"] += 1
+        moduleDict["debians"][debian] = size
 
     def getIntValue(self, value):
-        unitSpecified = False
-        for unit in self.acceptable_units:
-            if str(value).endswith(unit):
-                unitSpecified = True
-                break
-        if not unitSpecified:
+        match = self.value_regex.match(str(value))
+        if match is None:
             raise_error_and_exit("The value '{}' specified in {} does not "
                                  "have a correct unit specified. "
                                  "It should be one of {}"
                                  .format(value, self.size_limits_file,
                                          self.acceptable_units))
-        return int(re.findall('[0-9]+', str(value))[0])
+        return int(match.group(1))
 
 
 class FileParser:
@@ -3190,12 +3263,10 @@ class FileParser:
         # and then fallback to json_file.
         try:
             if json_str:
-                self.json_data = json.loads(
-                                    json_str, object_pairs_hook=OrderedDict)
+                self.json_data = json.loads(json_str)
             elif json_file:
                 with open(json_file, 'r', encoding='utf-8') as fd_json:
-                    self.json_data = json.load(
-                                        fd_json, object_pairs_hook=OrderedDict)
+                    self.json_data = json.load(fd_json)
             else:
                 raise_error_and_exit(
                         self.__class__.__name__ + ": Require input json_file "
@@ -3305,27 +3376,28 @@ class FileParser:
                 raise_error_and_exit("Required Field: '" + field
                                      + "' absent from the input CONFIG file: '"
                                      + self.json_file + "'.")
-        for field in self.string_fields:
-            if field in self.json_data and not isinstance(
-                    self.json_data[field],
-                    str) and self.json_data[field] is not None:
-                raise_error_and_exit(
-                        field + ": Value is not a string in the input CONFIG"
-                        + " file: '" + self.json_file + "'.")
-        for field in self.array_fields:
-            if field in self.json_data and not isinstance(
-                    self.json_data[field],
-                    list) and self.json_data[field] is not None:
-                raise_error_and_exit(
-                        field + ": Value is not a list in the input CONFIG"
-                        + " file: '" + self.json_file + "'.")
-        for field in self.dict_fields:
-            if field in self.json_data and not isinstance(
-                    self.json_data[field],
-                    dict) and self.json_data[field] is not None:
+        for field, field_type, type_name in self.field_types:
+            value = self.json_data.get(field)
+            if value is not None and not isinstance(value, field_type):
                 raise_error_and_exit(
-                        field + ": Value is not a dict in the input CONFIG"
-                        + " file: '" + self.json_file + "'.")
+                        field + ": Value is not a " + type_name + " in the "
+                        + "input CONFIG file: '" + self.json_file + "'.")
+
+    @classmethod
+    def get_field_types(cls):
+        """
+        Returns the (field, type, type name) entries checked by validate.
+        """
+        return ([(field, str, "string") for field in cls.string_fields]
+                + [(field, list, "list") for field in cls.array_fields]
+                + [(field, dict, "dict") for field in cls.dict_fields])
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.field_types = cls.get_field_types()
+
+
+FileParser.field_types = FileParser.get_field_types()
 
 
 class QNXFileParser(FileParser):
@@ -3512,8 +3584,8 @@ class Image:
         Creates output image file blob without any filesystem.
         """
         Executor.execute_on_host(
-                "dd", "if=" + self.input_stream + " of=" + self.image_path
-                + " bs=" + str(self.bs) + " count=" + str(self.noblks))
+                "dd", ["if=" + self.input_stream, "of=" + self.image_path,
+                       "bs=" + str(self.bs), "count=" + str(self.noblks)])
 
     @staticmethod
     def get_blocks(path, block_size):
@@ -3535,20 +3607,66 @@ class Image:
         """
         tot_blks = 0
         hardlink_dict = {}
-        for dirpath, dirnames, filenames in os.walk(os.path.abspath(path)):
-            for f in filenames + dirnames:
-                fp = os.path.join(dirpath, f)
-                lstat = os.lstat(fp)
-                size = lstat.st_size
-                if lstat.st_nlink > 1:
-                    if lstat.st_ino in hardlink_dict:
-                        size = 0
-                    else:
-                        hardlink_dict[lstat.st_ino] = 1
-                tot_blks += size//block_size + (1 if size % block_size else 0)
+        # Directories are scanned concurrently so that the stat latencies
+        # of slow or networked filesystems overlap
+        max_workers = (os.cpu_count() or 1) * 4
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {pool.submit(Image.scan_dir, os.path.abspath(path),
+                                   block_size)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    blks, hardlinks, subdirs = future.result()
+                    tot_blks += blks
+                    for ino, blks in hardlinks:
+                        if ino not in hardlink_dict:
+                            hardlink_dict[ino] = 1
+                            tot_blks += blks
+                    for subdir in subdirs:
+                        pending.add(pool.submit(Image.scan_dir, subdir,
+                                                block_size))
 
         return tot_blks
 
+    @staticmethod
+    def scan_dir(dirpath, block_size):
+        """
+        Returns the blocks used by the entries of a single directory
+
+        Parameters
+        ----------
+        dirpath     : str
+                      Path to the directory to scan.
+        block_size  : int
+                      Block Size of the filesystem
+
+        Returns
+        -------
+        tuple
+            Blocks used by entries with a single link, (inode, blocks) pairs
+            of hardlinked entries and the subdirectories to scan.
+        """
+        tot_blks = 0
+        hardlinks = []
+        subdirs = []
+        try:
+            entries = os.scandir(dirpath)
+        except OSError:
+            return tot_blks, hardlinks, subdirs
+        with entries:
+            for entry in entries:
+                # DirEntry caches the lstat result and the entry type
+                lstat = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                # Ceiling division
+                blks = -(-lstat.st_size // block_size)
+                if lstat.st_nlink > 1:
+                    hardlinks.append((lstat.st_ino, blks))
+                else:
+                    tot_blks += blks
+        return tot_blks, hardlinks, subdirs
+
 
 class QNX6Image():
     """
@@ -3581,7 +3699,7 @@ class QNX6Image():
         self.qnx_build_file = qnx_build_file
         self.manifest_file = manifest_file
         self.log_level = log_level
-        self.mkxfs_options = " -nn -D -t qnx6fsimg "
+        self.mkxfs_options = ["-nn", "-D", "-t", "qnx6fsimg"]
 
     def createImage(self):
         """
@@ -3590,17 +3708,16 @@ class QNX6Image():
         # Create qnx6fsimg image
         logging.info("Creating '%s'..." % self.image_path)
         if self.manifest_file:
-            self.mkxfs_options += " -f " + self.manifest_file
+            self.mkxfs_options += ["-f", self.manifest_file]
         if self.log_level <= logging.INFO:
-            self.mkxfs_options += " -vv"
+            self.mkxfs_options.append("-vv")
         if (not self.qnx_build_file):
             raise_error_and_exit("Build-FS was unable to determine the"
                                  "name of the QNX buildfile from the Build-FS "
                                  "config")
         Executor.execute_on_host(os.environ["QNX_HOST"] +
-                                 "/usr/bin/mkxfs", self.mkxfs_options + " "
-                                 + self.qnx_build_file + " "
-                                 + self.image_path)
+                                 "/usr/bin/mkxfs", self.mkxfs_options
+                                 + [self.qnx_build_file, self.image_path])
         logging.info("targetfs '%s' created." % self.image_path)
 
 
@@ -3636,7 +3753,7 @@ class QNXIFSImage():
         self.qnx_build_file = qnx_build_file
         self.manifest_file = manifest_file
         self.log_level = log_level
-        self.mkifs_options = ""
+        self.mkifs_options = []
 
     def createImage(self):
         """
@@ -3645,13 +3762,12 @@ class QNXIFSImage():
         # Create qnx6fsimg image
         logging.info("Creating '{}'...".format(self.image_path))
         if self.log_level <= logging.INFO:
-            self.mkifs_options += " -v "
+            self.mkifs_options.append("-v")
         Executor.execute_on_host(
                 os.environ["QNX_HOST"] + "/usr/bin/mkifs",
-                " -a {} ".format(os.path.basename(self.image_path)) +
-                " ".join([self.mkifs_options,
-                         self.qnx_build_file,
-                         self.image_path]))
+                ["-a", os.path.basename(self.image_path)]
+                + self.mkifs_options
+                + [self.qnx_build_file, self.image_path])
         logging.info("IFS '{}' created.".format(self.image_path))
 
 
@@ -3700,9 +3816,8 @@ class ExtImage(Image):
         self.byte_inode_ratio = category_data["byte_inode_ratio"]
         self.inode_size = category_data["inode_size"]
         self.journal_blocks = category_data["journal_blocks"]
-        self.journal_size = math.ceil(
-                (self.journal_blocks*self.block_size) / (1024*1024))
-        self.inode_byte_ratio = 1 / self.byte_inode_ratio
+        self.journal_size = -(
+                -(self.journal_blocks*self.block_size) // (1024*1024))
         self.tree_blocks = tree_blocks
 
         super().__init__(image_path, tree_blocks, input_stream,
@@ -3749,10 +3864,10 @@ class ExtImage(Image):
         logging.debug("Tree + Reserve + Journal Blocks: %d", total_blocks)
 
         # Add No of Blocks required for inodes
-        total_inodes = math.ceil(
-                total_blocks * self.block_size * self.inode_byte_ratio)
-        total_inode_blocks = math.ceil(
-                (total_inodes * self.inode_size)/self.block_size)
+        total_inodes = -(
+                -(total_blocks * self.block_size) // self.byte_inode_ratio)
+        total_inode_blocks = -(
+                -(total_inodes * self.inode_size) // self.block_size)
         total_blocks += total_inode_blocks
         logging.debug("Tree + Journal + Reserve + Inodes Blocks: %d",
                       total_blocks)
@@ -3763,7 +3878,7 @@ class ExtImage(Image):
                 "Target filesystem tree size '{}'B + metadata size '{}'B " +
                 "is larger than specified ImageSize '{}'B. ").format(
                     self.__tree_blocks * self.block_size,
-                    (self.total_blocks - self.__tree_blocks)*self.block_size,
+                    (total_blocks - self.__tree_blocks)*self.block_size,
                     self.final_size))
         self.noblks = total_blocks
 
@@ -3775,9 +3890,6 @@ class ExtImage(Image):
         super().create_image()
         ver_out = Executor.execute_on_host(
                 'e2fsck', '-V', stderr=PIPE)["stderr"]
-        e2fsprogs_ver_out = Executor.execute_on_host(
-                'grep', r'-oP "version\s*\K[0-9.]*"',
-                stdin=ver_out, stdout=PIPE)["stdout"]
         mkfs_opts = "-t {fs_type} -i {byinode_ratio} -J size={journal_size}" \
                     " -I {inode_size} -b {block_size} -F {image_path}".format(
                             fs_type=self.fs_type,
@@ -3786,9 +3898,14 @@ class ExtImage(Image):
                             inode_size=self.inode_size,
                             block_size=self.block_size,
                             image_path=self.image_path)
-        e2fsprogs_ver = e2fsprogs_ver_out.decode('utf-8')
+        e2fsprogs_ver_match = E2FSPROGS_VERSION_REGEX.search(ver_out)
+        if e2fsprogs_ver_match is None:
+            raise_error_and_exit("Unable to determine the version of "
+                                 "e2fsprogs from 'e2fsck -V'")
+        e2fsprogs_ver = e2fsprogs_ver_match.group(1).decode('utf-8')
         logging.info("Version of e2fsprogs is : " + e2fsprogs_ver)
-        if LooseVersion(e2fsprogs_ver) > LooseVersion("1.43"):
+        if (tuple(int(x) for x in e2fsprogs_ver.split(".") if x)
+                > E2FSPROGS_COMPAT_VERSION):
             mkfs_opts += EXT_BACKWARDS_COMPAT_OPT
 
         Executor.execute_on_host("mke2fs", mkfs_opts)
@@ -3836,23 +3953,26 @@ class ExtImage(Image):
         return None
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def get_category_dict(cls, ext_data=EXT_DATA):
         """
         Convert 2D category data into a dict for easy access
 
         Parameters
         ----------
-        ext_data    : list
-                      EXT Image classification 2D array of the format:
-                      [
-                        [category1, min_size, max_size, usage_type,
-                         block_size, byte_inode_ratio, journal_blocks],
-                        [category2, min_size, max_size, usage_type,
-                         block_size, byte_inode_ratio, journal_blocks],
+        ext_data    : tuple
+                      EXT Image classification 2D tuple of the format:
+                      (
+                        (category1, min_size, max_size, usage_type,
+                         block_size, byte_inode_ratio, journal_blocks),
+                        (category2, min_size, max_size, usage_type,
+                         block_size, byte_inode_ratio, journal_blocks),
                          .
                          .
-                      ]
+                      )
                       (default is EXT4 data)
+                      The result is cached, so ext_data must be hashable
+                      and the returned dict must not be modified.
 
         Returns
         -------
@@ -3876,23 +3996,18 @@ class ExtImage(Image):
                 .
             }
         """
-        categories_data = {}
-        category_data = {}
-        for row in ext_data:
-            category_data["min_size"] = row[1]
-            category_data["max_size"] = row[2]
-            category_data["usage_type"] = row[3]
-            category_data["block_size"] = row[4]
-            category_data["byte_inode_ratio"] = row[5]
-            category_data["inode_size"] = row[6]
-            try:
-                category_data["journal_blocks"] = row[7]
-            except IndexError:
-                category_data["journal_blocks"] = 0
-
-            categories_data[row[0]] = category_data.copy()
-
-        return categories_data
+        return {
+            row[0]: {
+                "min_size": row[1],
+                "max_size": row[2],
+                "usage_type": row[3],
+                "block_size": row[4],
+                "byte_inode_ratio": row[5],
+                "inode_size": row[6],
+                "journal_blocks": row[7] if len(row) > 7 else 0,
+            }
+            for row in ext_data
+        }
 
 
 # Helper wrappers
@@ -3915,95 +4030,95 @@ def define_options(parser):
 
     Parameters
     ----------
-    parser      : OptionParser
-                  OptionParser object for parsing commandline.
+    parser      : ArgumentParser
+                  ArgumentParser object for parsing commandline.
 
     Returns
     -------
     tuple
         (options, args)
-        options (Values object), contains all the parsed options in cmdline.
-        args (list), contains the remaining unparsed arguments.
+        options (Namespace object), contains all the parsed options in
+        cmdline.
+        args (list), contains the remaining positional arguments.
     """
-    parser.add_option(
-            "-i", "--input", type="string", dest="json_path",
+    parser.add_argument(
+            "-i", "--input", dest="json_path",
             help="Input config file.")
-    parser.add_option(
-            "-o", "--output", type="string", dest="output_folder",
+    parser.add_argument(
+            "-o", "--output", dest="output_folder",
             default="./", help="Output folder. Default option is ${PWD}.")
-    parser.add_option(
+    parser.add_argument(
             "-m", "--manifest-only", action="store_true", dest="manifest_only",
             default=False, help="Generate Manifest only. Do not install.")
-    parser.add_option(
-            "-v", "--version", action="callback", callback=print_version,
+    parser.add_argument(
+            "-v", "--version", action="version",
+            version="Build-FS Version: " + VERSION,
             help="Print Version and exit.")
-    parser.add_option(
-            "--create-tar", type="choice", choices=("yes", "no"),
+    parser.add_argument(
+            "--create-tar", choices=("yes", "no"),
             default="no", dest="create_tar",
             help="Create output tarball. Valid options are 'yes','no'."
             + " Option not applicable for OS: QNX"
             + "\nDefault option is 'no'.")
-    parser.add_option(
-            "--create-image", type="choice", choices=("yes", "no"),
+    parser.add_argument(
+            "--create-image", choices=("yes", "no"),
             default="yes", dest="create_image",
             help="Create output image. Valid options are 'yes','no'."
             + " Default option is 'yes'.")
-    parser.add_option(
-            "-w", "--nv-workspace", type="string", dest="nv_workspace",
+    parser.add_argument(
+            "-w", "--nv-workspace", dest="nv_workspace",
             help="Workspace from which files to be copied to the target"
             + " are obtained.")
-    parser.add_option(
-            "--copytarget-source-type", type="string",
+    parser.add_argument(
+            "--copytarget-source-type",
             dest="copytarget_source_type", default="pdk_sdk_installed_path",
             help="Source type argument to be passed to copytarget tool."
             + " Default option is 'pdk_sdk_installed_path'.")
-    parser.add_option(
-            "--log-level", type="choice", choices=(
+    parser.add_argument(
+            "--log-level", choices=(
                 "debug", "info", "warning", "error", "critical"),
             default="info", dest="log_level",
             help="Set log level for the tool")
-    parser.add_option(
-            "-f", "--filesystem-working-directory", type="string",
+    parser.add_argument(
+            "-f", "--filesystem-working-directory",
             dest="filesystem_work_folder", help="Filesystem working folder"
             + " will be the folder specified. If not specified, a tmp folder"
             + " is created which acts as working folder."
             + " Option not applicable for OS: QNX")
-    parser.add_option(
-            "--working-directory", type="string",
+    parser.add_argument(
+            "--working-directory",
             dest="work_folder", help="Build-FS working folder"
             + " will be the folder specified. If not specified, a tmp folder"
             + " is created which acts as working folder.")
-    parser.add_option(
-            "--generate-intermediate", type="choice", choices=("yes", "no"),
+    parser.add_argument(
+            "--generate-intermediate", choices=("yes", "no"),
             dest="generate_intermediate", default="yes",
             help="Create intermediate Parent CONFIG outputs. Valid options"
             + " are 'yes', 'no'. Default option is 'yes'.")
-    parser.add_option(
+    parser.add_argument(
             "--generate-target-size-file", dest="generate_target_size_file",
-            type="choice", choices=("yes", "no"), default="no",
+            choices=("yes", "no"), default="no",
             help="Create a file (in YAML format) with details pertaining to "
             "the sizes of files copied to the filesystem.")
-    parser.add_option(
+    parser.add_argument(
             "--size-limits-file", dest="size_limits_file", default=None,
             help="Specify the path to a manifest that lists the maximum"
             "size of files that each module can use. Note: This option"
             "can only be used along with --target-size-file")
-    parser.add_option(
+    parser.add_argument(
             "--create-spreadsheet", dest="spreadsheet_file", default=None,
             help="Specify the path of the Excel spreadsheet the should "
             "contain the items in the FS. "
             "Note: This spreadsheet will be in XML format.")
-    parser.add_option(
+    parser.add_argument(
             "--spreadsheet-metadata", dest="spreadsheet_meta", default=None,
             help="Specify the path of the spreadsheet metadata file."
             "This metadata file controls what attributes from the "
             "CopyTarget YAML manifest appear in the spreadsheet")
-    return parser.parse_args()
-
-
-def print_version(option, opt, value, parser):
-    print("Build-FS Version: " + VERSION)
-    sys.exit(0)
+    parser.add_argument(
+            "args", nargs="*", help="Input config file, if -i is not used.")
+    options = parser.parse_args()
+    return options, options.args
 
 
 if __name__ == "__main__":
@@ -4011,7 +4126,7 @@ if __name__ == "__main__":
     Environment.unset(unset_vars)
     Environment.set_exist(set_vars)
     # Parse command line
-    parser = OptionParser()
+    parser = ArgumentParser()
     (options, args) = define_options(parser)
     init_logger(options.log_level, options.output_folder)
 
@@ -4026,14 +4141,13 @@ if __name__ == "__main__":
 
     # Source the main config.json common section followed by OS section,
     # exit if any REQUIRED_VARIABLE has not been defined
-    if Environment.get("BUILD_FS_ENV"):
-        BUILD_FS_ENV = Environment.get("BUILD_FS_ENV")
+    BUILD_FS_ENV = Environment.get("BUILD_FS_ENV") or BUILD_FS_ENV
     logging.info("Reading Configuration File: '{env}'".format(
             env=BUILD_FS_ENV))
     Environment.source(BUILD_FS_ENV, 'common')
-    if Environment.get('REQUIRED_VARIABLES'):
-        Environment.exit_if_not_defined(
-                Environment.get('REQUIRED_VARIABLES').split(','))
+    required_variables = Environment.get('REQUIRED_VARIABLES')
+    if required_variables:
+        Environment.exit_if_not_defined(required_variables.split(','))
         Environment.unset(['REQUIRED_VARIABLES'])
 
     if options.json_path:
@@ -4045,20 +4159,21 @@ if __name__ == "__main__":
         raise_error_and_exit("No CONFIG provided with the '-i' option.")
     if json_file == "STDIN":
         json_str = sys.stdin.read()
-    elif os.path.exists(json_file):
-        with open(json_file, 'r', encoding='utf-8') as f:
-            json_str = f.read()
     else:
-        raise_error_and_exit("CONFIG file: '" + json_file + "' doesn't exist.")
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                json_str = f.read()
+        except FileNotFoundError:
+            raise_error_and_exit(
+                    "CONFIG file: '" + json_file + "' doesn't exist.")
 
     config_os = FileParser(json_file=json_file, json_str=json_str).get_os()
     Environment.source(BUILD_FS_ENV, config_os.lower())
-    if Environment.get('REQUIRED_VARIABLES'):
-        Environment.exit_if_not_defined(
-                Environment.get('REQUIRED_VARIABLES').split(','))
+    required_variables = Environment.get('REQUIRED_VARIABLES')
+    if required_variables:
+        Environment.exit_if_not_defined(required_variables.split(','))
         Environment.unset(['REQUIRED_VARIABLES'])
-    if Environment.get('BUILD_FS_DIR'):
-        BUILD_FS_DIR = Environment.get('BUILD_FS_DIR')
+    BUILD_FS_DIR = Environment.get('BUILD_FS_DIR') or BUILD_FS_DIR
 
     if options.size_limits_file is not None:
         if options.generate_target_size_file != "yes":
@@ -13,7 +13,7 @@ import shlex
 import shutil
 import sys
 import logging
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, DEVNULL
 
 # String Constants
 NOT_EXISTS = "/not/exists/"
@@ -52,6 +52,7 @@ class Executor:
         self.work_dir = work_dir
         self.filesystem_work_dir = filesystem_work_dir
         self.target_mount_list = []
+        self.qemu_path = os.getenv('QEMU_PATH') or QEMU_PATH
 
     @staticmethod
     def execute_on_host(program, arguments, exit_on_failure=True, stdin=None,
@@ -63,8 +64,9 @@ class Executor:
         ----------
         program         : str
                           Binary to be executed.
-        arguments       : str
+        arguments       : str, list
                           Args to be passed to the binary being executed.
+                          A list is passed as is, without being split.
         exit_on_failure : bool
                           Controls if Build-FS should exit on Non-zero
                           return code returned by binary. (default is True)
@@ -86,11 +88,17 @@ class Executor:
             of standard output, standard error and return code of
             the binary execution.
         """
-        cmd_string = program + ' ' + arguments
-        cmd = shlex.split(cmd_string)
+        if isinstance(arguments, list):
+            cmd = [program] + arguments
+            cmd_string = shlex.join(cmd)
+        else:
+            cmd_string = program + ' ' + arguments
+            cmd = shlex.split(cmd_string)
         if not silent:
             logging.info("Executing " + cmd_string)
-        process = Popen(cmd, stdin=PIPE, stdout=stdout, stderr=stderr)
+        # Without input the child reads from /dev/null, saving a pipe
+        process = Popen(cmd, stdin=PIPE if stdin is not None else DEVNULL,
+                        stdout=stdout, stderr=stderr)
         stdout, stderr = process.communicate(stdin)
         rc = process.returncode
         if rc != 0 and exit_on_failure is True:
@@ -146,52 +154,42 @@ class Executor:
         Sets up the the arm64 target filesystem directory for chroot.
         """
         # Setup arm64
-        global QEMU_PATH
-        if os.getenv('QEMU_PATH'):
-            QEMU_PATH = os.getenv('QEMU_PATH')
-
-        shutil.copy2(QEMU_PATH+'/qemu-aarch64-static',
-                     self.filesystem_work_dir + '/usr/bin/')
-        perm = os.stat(self.filesystem_work_dir + QEMU_BIN).st_mode & 0o777
-        perm_withx = perm | 0o111
-        os.chmod(self.filesystem_work_dir + QEMU_BIN, perm_withx)
-        self.execute_on_host('mount', '--bind -r /dev '
-                             + self.filesystem_work_dir
-                             + '/dev', silent=True)
-        self.execute_on_host('mount', '--bind -r /sys '
-                             + self.filesystem_work_dir
-                             + '/sys', silent=True)
-        self.execute_on_host('mount', '--bind -r /proc '
-                             + self.filesystem_work_dir
-                             + '/proc', silent=True)
-        # For bind mounts to be truly read-only, you need
-        # to remount it as read-only to enable the RO flag.
-        self.execute_on_host('mount', '-o bind,remount,ro '
-                             + '/dev/ '
-                             + self.filesystem_work_dir
-                             + '/dev/', silent=True)
-
+        # Only the contents are needed, the mode is set right after
+        shutil.copyfile(self.qemu_path + '/qemu-aarch64-static',
+                        self.filesystem_work_dir + QEMU_BIN)
+        os.chmod(self.filesystem_work_dir + QEMU_BIN, 0o755)
+        # All mounts are issued from a single shell instead of one process
+        # per mount
+        mounts = [
+            ['--bind', '-r', '/dev', self.filesystem_work_dir + '/dev'],
+            ['--bind', '-r', '/sys', self.filesystem_work_dir + '/sys'],
+            ['--bind', '-r', '/proc', self.filesystem_work_dir + '/proc'],
+            # For bind mounts to be truly read-only, you need
+            # to remount it as read-only to enable the RO flag.
+            ['-o', 'bind,remount,ro', '/dev/',
+             self.filesystem_work_dir + '/dev/']]
         for n in self.target_mount_list:
-            self.execute_on_host('mount', '--bind -r ' + n[0] + ' '
-                                 + self.filesystem_work_dir
-                                 + n[1], silent=True)
+            mounts.append(['--bind', '-r', n[0],
+                           self.filesystem_work_dir + n[1]])
+        self.execute_on_host(
+                'sh', ['-c', ' && '.join(shlex.join(['mount'] + mount)
+                                         for mount in mounts)],
+                silent=True)
 
     def cleanup_arm64_chroot(self):
         """
         Removes the setup required for chroot from the arm64 target filesystem
         directory.
         """
-        # cleanup
-        for n in self.target_mount_list:
-            self.execute_on_host('umount', self.filesystem_work_dir + n[1],
-                                 exit_on_failure=False, silent=True)
-
-        self.execute_on_host('umount', self.filesystem_work_dir + '/dev',
-                             exit_on_failure=False, silent=True, stderr=PIPE)
-        self.execute_on_host('umount', self.filesystem_work_dir + '/sys',
-                             exit_on_failure=False, silent=True, stderr=PIPE)
-        self.execute_on_host('umount', self.filesystem_work_dir + '/proc',
-                             exit_on_failure=False, silent=True, stderr=PIPE)
+        # cleanup, with all umounts issued from a single shell. Failures to
+        # unmount /dev, /sys and /proc are not reported.
+        umounts = [shlex.join(['umount', self.filesystem_work_dir + n[1]])
+                   for n in self.target_mount_list]
+        for n in ['/dev', '/sys', '/proc']:
+            umounts.append(shlex.join(['umount', self.filesystem_work_dir + n])
+                           + ' 2>/dev/null')
+        self.execute_on_host('sh', ['-c', '; '.join(umounts)],
+                             exit_on_failure=False, silent=True)
         if os.path.exists(self.filesystem_work_dir + QEMU_BIN):
             os.remove(self.filesystem_work_dir + QEMU_BIN)
 
@@ -16,16 +16,28 @@ import os
 import re
 import sys
 import copy
+import glob
 import json
 import yaml
+import mmap
+import stat
+import errno
+import struct
 import shutil
 import hashlib
+import functools
 import traceback
-import subprocess
 from optparse import OptionParser
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree as ET
 from io import BytesIO
+try:
+    from yaml import CBaseLoader as BaseLoader
+    from yaml import CSafeLoader as SafeLoader
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import BaseLoader, SafeLoader, SafeDumper
 
 VERSION = "1.4.10"
 UIDMAPFILE = "/etc/passwd"
@@ -37,12 +49,20 @@ DEFAULT = {
     "sourceType": "pdk_sdk_installed_path",
     "filesystemType": "standard",
     "doChown": True,
-    "autocreateParentDir": True
+    "autocreateParentDir": True,
+    "jobs": (os.cpu_count() or 1) * 2
 }
-DOMAIN = {  # Defines a list of accepted values for a variable
-    "positive_values": ['true', 'True', 'yes', True],
-    "negative_values": ['false', 'False', 'no', False]
+DOMAIN = {  # Defines a set of accepted values for a variable
+    "positive_values": frozenset(['true', 'True', 'yes', True]),
+    "negative_values": frozenset(['false', 'False', 'no', False])
 }
+# Manifest strings converted to booleans by getValueFromDict
+TRUE_STRINGS = frozenset(['true', 'True', 'yes'])
+FALSE_STRINGS = frozenset(['false', 'False', 'no'])
+# Matches ${VAR} or $VAR references to environment variables
+ENVVAR_REGEX = re.compile(r"[$]{(.+?)}|[$]([a-zA-Z_]+[a-zA-Z0-9_]*)")
+# ($export, ${export}) literals and patterns, keyed by export name
+EXPORT_REGEX_CACHE = {}
 
 
 class CopyTarget:
@@ -61,8 +81,10 @@ class CopyTarget:
         self.uidMapFileExists = False
         self.gidMapFileExists = False
         self.manifest_module = None
-        self.identifierDict = {}
-        self.fileListDict = OrderedDict()
+        self.identifierDict = {"UID": {}, "GID": {}}
+        self.identifierCache = {}
+        self.fileListDict = {}
+        self.cfgCache = {}
         self.exports = []
         self.verifyYAMLOnly = False
         self.doChown = DEFAULT["doChown"]
@@ -70,6 +92,7 @@ class CopyTarget:
         self.spreadsheetFile = None
         self.spreadsheet = None
         self.mountPoint = None
+        self.mountPointPrefix = None
         self.digestMetadata = CopyTargetDigestMetadata(None)
         try:
             self.recordFileSize = FileSizeRecords(allOptions.targetSizeFile)
@@ -90,6 +113,10 @@ class CopyTarget:
                 if allOptions.mountPoint is not None:
                     self.mountPoint = CopyTarget.normpath(
                         allOptions.mountPoint)
+                    # Mount point without its trailing slash, as expected
+                    # at the start of each destination
+                    self.mountPointPrefix = self.mountPoint[:-1] \
+                        if self.mountPoint.endswith("/") else self.mountPoint
             except AttributeError as e:
                 pass
 
@@ -154,27 +181,8 @@ class CopyTarget:
                   % self.uidMapFile)
             self.uidMapFileExists = False
         else:
-            try:
-                with open(self.uidMapFile, "r", encoding='utf-8') as f:
-                    for line in f:
-                        cols = line.split(":")
-                        if len(cols) >= 3:
-                            if cols[0] not in self.identifierDict:
-                                self.identifierDict[cols[0]] = {}
-                            try:
-                                self.identifierDict[cols[0]]["UID"] = \
-                                    int(cols[2])
-                            except ValueError as e:
-                                # Ignore lines from passwd file that
-                                # cannot be parsed. An error will be displayed
-                                # at a later stage, when consuming the values,
-                                # in cases the required data is not found.
-                                pass
-            except:
-                traceback.print_exc()
-                print("Error: Unable to parse '%s'"
-                      % (self.uidMapFile), file=sys.stderr)
-                sys.exit(1)
+            self.identifierDict["UID"] = self.readIdentifierMap(
+                self.uidMapFile)
             self.uidMapFileExists = True
 
         if not os.path.exists(self.gidMapFile):
@@ -183,38 +191,54 @@ class CopyTarget:
                   % self.gidMapFile)
             self.gidMapFileExists = False
         else:
-            try:
-                with open(self.gidMapFile, "r", encoding='utf-8') as f:
-                    for line in f:
-                        cols = line.split(":")
-                        if len(cols) >= 3:
-                            if cols[0] not in self.identifierDict:
-                                self.identifierDict[cols[0]] = {}
-                            try:
-                                self.identifierDict[cols[0]]["GID"] = \
-                                    int(cols[2])
-                            except ValueError as e:
-                                pass
-            except:
-                traceback.print_exc()
-                print("Error: Unable to parse '%s'"
-                      % (self.gidMapFile), file=sys.stderr)
-                sys.exit(1)
+            self.identifierDict["GID"] = self.readIdentifierMap(
+                self.gidMapFile)
             self.gidMapFileExists = True
 
+    # Returns a {name: identifier} dictionary read from a passwd or group
+    # file, which are small enough to be read and split in one go
+    @staticmethod
+    def readIdentifierMap(mapFile):
+        identifierMap = {}
+        try:
+            with open(mapFile, "r", encoding='utf-8') as f:
+                data = f.read()
+            for line in data.split("\n"):
+                cols = line.split(":", 3)
+                if len(cols) >= 3:
+                    try:
+                        identifierMap[cols[0]] = int(cols[2])
+                    except ValueError as e:
+                        # Ignore lines from passwd/group files that cannot
+                        # be parsed. An error will be displayed at a later
+                        # stage, when consuming the values, in cases the
+                        # required data is not found.
+                        pass
+        except:
+            traceback.print_exc()
+            print("Error: Unable to parse '%s'"
+                  % (mapFile), file=sys.stderr)
+            sys.exit(1)
+        return identifierMap
+
     # Returns the UID and GID assigned to a user on the system
     def getIdentifier(self, user, type):
+        # Most items share a handful of owners and groups
+        identifier = self.identifierCache.get((user, type))
+        if identifier is not None:
+            return identifier
         # Check if the user identifier is already a numeric value
         try:
-            if int(user):  # This will throw a ValueError if "user" is a string
-                pass
-            return int(user)
+            identifier = int(user)
         except ValueError:
             # This means that "user" is not a numeric value and UID/GID
             # has to be derived by looking at passwd file
             pass
         try:
-            return self.identifierDict[user][type]
+            if identifier is None:
+                identifier = self.identifierDict[type][user]
+            self.identifierCache[(user, type)] = identifier
+            return identifier
         except KeyError as e:
             traceback.print_exc()
             if self.uidMapFileExists and (type == "UID"):
@@ -244,13 +268,16 @@ class CopyTarget:
     # Iterate through each item in the CFG file and process it
     def processCFG(self, copytargetCFG, isLeafCopyTarget=True):
         print("Reading %s..." % os.path.abspath(copytargetCFG))
-        cfg = OrderedDict()
-        with open(copytargetCFG, "r", encoding='utf-8') as copytargetCFGHandle:
-            # YAML 1.1 and 1.2  have different octal notations.
-            # To prevent errors due to automatic value conversion,
-            # treat all values as strings by using Loader=yaml.BaseLoader.
-            cfg = CopyTarget.orderedYAMLLoad(copytargetCFGHandle,
-                                             Loader=yaml.BaseLoader)
+        # The same manifest may be imported by several others; only parse it
+        # again if it has changed
+        cfgKey = (os.path.realpath(copytargetCFG),
+                  os.stat(copytargetCFG).st_mtime_ns)
+        cfg = self.cfgCache.get(cfgKey)
+        if cfg is None:
+            with open(copytargetCFG, "r",
+                      encoding='utf-8') as copytargetCFGHandle:
+                cfg = CopyTarget.loadCFG(copytargetCFGHandle)
+            self.cfgCache[cfgKey] = cfg
         if "version" in cfg:
             if cfg["version"] not in COMPATIBLE_MANIFEST_VERSIONS:
                 print("Error: %s version %s is incompatible with %s "
@@ -292,8 +319,13 @@ class CopyTarget:
         for item in cfg["fileList"]:
             i += 1
             self.updateFileListDict(item, i, copytargetCFG)
+        # fileListDict holds everything needed from the parsed manifest, so
+        # release it before the copy phase below
+        del cfg
         print("Read %d items from %s" % (i, os.path.abspath(copytargetCFG)))
         if isLeafCopyTarget:
+            # All imports have been read at this point
+            self.cfgCache.clear()
             i = 0
             if self.findRestrictedSourceFiles is not None:
                 print("Searching {} for restricted file items..."
@@ -310,18 +342,22 @@ class CopyTarget:
                     print('[%d, %s] ' % (i, key))
                     sys.stdout.flush()
                     self.processFileItem(item, i)
+                self.finishFileItems()
             if self.spreadsheet is not None:
                 self.spreadsheet.createSpreadsheet()
             self.digestMetadata.writeGoldenDigestFile()
-            self.fileListDict = OrderedDict()
+            self.fileListDict = {}
+
+    # Complete the work left pending by processFileItem(). Targets that
+    # process items asynchronously override this.
+    def finishFileItems(self):
+        pass
 
     def trimMountPoint(self, destination):
         if self.mountPoint is not None and os.getenv(
                 "NV_COPYTARGET_DESTINATION_INCLUDES_MOUNTPOINT",
                 "true") != "false":
-            mountPoint = self.mountPoint
-            if mountPoint.endswith("/"):
-                mountPoint = mountPoint[:-1]
+            mountPoint = self.mountPointPrefix
             if destination.startswith(mountPoint):
                 destination = destination[len(mountPoint):]
             else:
@@ -337,9 +373,9 @@ class CopyTarget:
         return destination
 
     def updateFileListDict(self, item, pos, copytargetCFG):
+        rawDestination = self.getValueFromDict(item, "destination")
         destination = CopyTarget.normpath(
-            CopyTarget.expandvars(
-                self.getValueFromDict(item, "destination"), self.exports))
+            CopyTarget.expandvars(rawDestination, self.exports))
 
         # Do not add items of different filesystemType to fileListDict
         # Note: A file is copied if the manifest does not define "filesystems"
@@ -364,10 +400,10 @@ class CopyTarget:
                       % (self.filesystemType, destination, copytargetCFG),
                       file=sys.stderr)
                 sys.exit(1)
-        if destination not in self.fileListDict:
-            self.fileListDict[destination] = {}
-        self.fileListDict[destination]["destination"] = self.getValueFromDict(
-            item, "destination")
+        entry = self.fileListDict.get(destination)
+        if entry is None:
+            entry = self.fileListDict[destination] = {}
+        entry["destination"] = rawDestination
         if filesystemDict and "destination" in filesystemDict:
             print("Error: 'destination' key for '%s' in '%s' cannot be "
                   "overridden under 'filesystems' field"
@@ -382,9 +418,8 @@ class CopyTarget:
                     if self.sourceType is None:
                         # Choose default source type if the user has not
                         # explicitly specified a source type
-                        self.fileListDict[destination]["source"] = source[
-                            DEFAULT["sourceType"]]
-                        if not self.fileListDict[destination]["source"]:
+                        entry["source"] = source[DEFAULT["sourceType"]]
+                        if not entry["source"]:
                             print("Error: '%s' source path for '%s' is not "
                                   "defined in '%s' manifest"
                                   % (DEFAULT["sourceType"],
@@ -392,9 +427,8 @@ class CopyTarget:
                                   file=sys.stderr)
                             sys.exit(1)
                     else:
-                        self.fileListDict[destination]["source"] = source[
-                            self.sourceType]
-                        if not self.fileListDict[destination]["source"]:
+                        entry["source"] = source[self.sourceType]
+                        if not entry["source"]:
                             print("Error: '%s' source path for '%s' is not "
                                   "defined in '%s' manifest"
                                   % (self.sourceType,
@@ -415,59 +449,57 @@ class CopyTarget:
                           "position '%d' that does not accept source types"
                           % (copytargetCFG, destination, pos), file=sys.stderr)
                     sys.exit(1)
-                self.fileListDict[destination]["source"] = source
-                if not self.fileListDict[destination]["source"]:
+                entry["source"] = source
+                if not entry["source"]:
                     print("Error: Source path for '%s' is not defined "
                           "in '%s' manifest"
                           % (destination, copytargetCFG),
                           file=sys.stderr)
                     sys.exit(1)
-            if self.getValueFromDict(self.fileListDict[destination],
-                                     "remove", False):
+            if self.getValueFromDict(entry, "remove", False):
                 print("\033[93mWARNING: Directive for '%s' has been "
                       "redefined. Since a source is defined for this file, "
                       "it is no longer marked for removal."
                       "\033[0m" % (destination))
-                self.fileListDict[destination]["remove"] = "false"
+                entry["remove"] = "false"
         perm = self.getValueFromDict(item, "perm", False, filesystemDict)
         if perm:
-            self.fileListDict[destination]["perm"] = perm
+            entry["perm"] = perm
         owner = self.getValueFromDict(item, "owner", False, filesystemDict)
         if owner:
-            self.fileListDict[destination]["owner"] = owner
+            entry["owner"] = owner
         group = self.getValueFromDict(item, "group", False, filesystemDict)
         if group:
-            self.fileListDict[destination]["group"] = group
+            entry["group"] = group
         raw = self.getValueFromDict(item, "raw", False, filesystemDict)
         if raw:
-            self.fileListDict[destination]["raw"] = raw
+            entry["raw"] = raw
         remove = self.getValueFromDict(item, "remove", False, filesystemDict)
         if remove is not None:
-            self.fileListDict[destination]["remove"] = remove
+            entry["remove"] = remove
             # Remove source directive (if remove is set to true)
-            if self.getValueFromDict(self.fileListDict[destination],
-                                     "remove"):
-                if "source" in self.fileListDict[destination]:
+            if self.getValueFromDict(entry, "remove"):
+                if "source" in entry:
                     print("\033[93mWARNING: Directive for '%s' has been "
                           "redefined. This file is now marked for removal."
                           "\033[0m" % (destination))
-                    self.fileListDict[destination].pop("source")
+                    entry.pop("source")
         create_symlink = self.getValueFromDict(item, "create_symlink", False,
                                                filesystemDict)
         if create_symlink is not None:
-            self.fileListDict[destination]["create_symlink"] = create_symlink
+            entry["create_symlink"] = create_symlink
         module = self.getValueFromDict(item, "element", False, filesystemDict)
         if module:
-            self.fileListDict[destination]["module"] = module
+            entry["module"] = module
         elif self.manifest_module is not None:
-            self.fileListDict[destination]["module"] = self.manifest_module
+            entry["module"] = self.manifest_module
             item["element"] = self.manifest_module
-        elif "module" in self.fileListDict[destination]:
+        elif "module" in entry:
             # Handle case where the module for an entry has already been
             # defined earlier
             pass
         else:
-            self.fileListDict[destination]["module"] = "unknown"
+            entry["module"] = "unknown"
 
         # Add data from the spreadsheet
         if self.spreadsheet is not None:
@@ -476,74 +508,68 @@ class CopyTarget:
     # Returns a value of a key from dictionary
     def getValueFromDict(self, dictionary, key, isRequired="True",
                          overrideDictionary=None):
-        dict = copy.deepcopy(dictionary)
-        if overrideDictionary is not None:
-            try:
-                dict[key] = CopyTarget.mergeDict(dict[key],
-                                                 overrideDictionary[key])
-            except KeyError as e:
-                if key in overrideDictionary:
-                    dict[key] = copy.deepcopy(overrideDictionary[key])
-        try:
-            if dict[key] is not None:
-                if dict[key] in ['true', 'True', 'yes']:
-                    return True
-                elif dict[key] in ['false', 'False', 'no']:
-                    return False
-                return dict[key]
+        # Only the looked up value is merged with its override, so there is
+        # no need to copy the whole dictionary.
+        value = dictionary.get(key)
+        if overrideDictionary is not None and key in overrideDictionary:
+            if key in dictionary:
+                value = CopyTarget.mergeDict(value, overrideDictionary[key])
             else:
-                raise KeyError(key)
-        except KeyError as e:
+                value = copy.deepcopy(overrideDictionary[key])
+        if value is None:
+            # Missing optional keys are common, so this is not handled with
+            # an exception
             if isRequired:
-                traceback.print_exc()
-                print("Error: Expected key %s is not defined" % e,
+                print("Error: Expected key %r is not defined" % key,
                       file=sys.stderr)
                 sys.exit(1)
-            else:
-                return None
-
-    def executeCommand(self, command, exitOnFail=True):
-        print("--> EXEC %s" % (command))
-        try:
-            result = subprocess.run(command, stdout=subprocess.PIPE,
-                                    stderr=subprocess.STDOUT, shell=True,
-                                    check=exitOnFail, executable="bash")
-            print(result.stdout.decode('utf-8'))
-            return result
-        except subprocess.CalledProcessError as e:
-            print(e.stdout.decode('utf-8'))
-            raise
+            return None
+        if isinstance(value, str):
+            if value in TRUE_STRINGS:
+                return True
+            elif value in FALSE_STRINGS:
+                return False
+        return value
 
     # This function merges the data from dict2 into dict1 and returns the
-    # result. dict1 and dict2 remain unmodified.
+    # result. dict1 and dict2 remain unmodified, but the result shares the
+    # values (and the nested dictionaries not present in dict2) with them.
     @staticmethod
     def mergeDict(dict1, dict2):
         if not isinstance(dict2, dict):
             return dict2
-        result = copy.deepcopy(dict1)
+        result = copy.copy(dict1)
         for k, v in dict2.items():
             if isinstance(v, dict):
-                result[k] = CopyTarget.mergeDict(dict1.get(k, OrderedDict()),
-                                                 v)
+                result[k] = CopyTarget.mergeDict(dict1.get(k, {}), v)
             else:
-                result[k] = copy.deepcopy(dict2[k])
+                result[k] = v
         return result
 
     @staticmethod
     def expandvars(path, exports=[]):
+        # Most paths reference no variables at all
+        if "$" not in path:
+            return path
         for item in exports:
             for key in item:
                 # replace ${export} or $export variables in the path
                 # Note: this does not replace \${export} or \$export
-                path = re.sub(r"(?<!\\)[$]{0}".format(key),
-                              item[key], path)
-                path = re.sub(r"(?<!\\)[$]{{{0}}}".format(key),
-                              item[key], path)
+                patterns = EXPORT_REGEX_CACHE.get(key)
+                if patterns is None:
+                    patterns = EXPORT_REGEX_CACHE[key] = (
+                        ("$" + key,
+                         re.compile(r"(?<!\\)[$]" + re.escape(key))),
+                        ("${" + key + "}",
+                         re.compile(r"(?<!\\)[$]{" + re.escape(key) + "}")))
+                for literal, pattern in patterns:
+                    # Only run the regex when the path can match it
+                    if literal in path:
+                        path = pattern.sub(item[key], path)
         if os.getenv("NV_COPYTARGET_EXPANDVARS", "true") == "false":
             return path
         # Ensure there are no undefined environment variables in path
-        for matches in re.findall("[$]{(.+?)}|[$]([a-zA-Z_]+[a-zA-Z0-9_]*)",
-                                  path):
+        for matches in ENVVAR_REGEX.findall(path):
             match = matches[0] if matches[0] else matches[1]
             if match not in os.environ:
                 print("Error: Environment variable '%s' has not been "
@@ -551,10 +577,15 @@ class CopyTarget:
                 sys.exit(1)
         return os.path.expandvars(path)
 
+    # Paths repeat a lot across items and normpath only depends on its
+    # argument, so its results are memoized
     @staticmethod
+    @functools.lru_cache(maxsize=65536)
     def normpath(path):
-        if len(re.findall("[$]{(.+?)}|[$]([a-zA-Z_]+[a-zA-Z0-9_]*)", path
-                          )) == 0 or path.find("../") == -1:
+        # Cheap substring checks first; the regex only runs for paths that
+        # contain both a "$" and a "../"
+        if "$" not in path or "../" not in path or \
+                ENVVAR_REGEX.search(path) is None:
             normpath = os.path.normpath(path)
         else:
             # Do not use normpath() function if the path is relative.
@@ -569,20 +600,77 @@ class CopyTarget:
             return normpath.replace('//', '/') + "/"
         return normpath.replace('//', '/')
 
+    # Load a CFG file. Manifests written in JSON (a subset of YAML) are
+    # parsed with the much faster json module, keeping every scalar as the
+    # string BaseLoader would have returned.
+    @staticmethod
+    def loadCFG(stream):
+        data = stream.read()
+        if data.lstrip().startswith("{"):
+            try:
+                return CopyTarget.stringifyJSONScalars(json.loads(
+                    data, parse_int=str, parse_float=str, parse_constant=str))
+            except ValueError:
+                # Not JSON, but possibly still a YAML flow mapping
+                pass
+        # YAML 1.1 and 1.2  have different octal notations.
+        # To prevent errors due to automatic value conversion,
+        # treat all values as strings by using Loader=BaseLoader.
+        return CopyTarget.orderedYAMLLoad(data, Loader=BaseLoader)
+
     @staticmethod
-    def orderedYAMLLoad(stream, Loader=yaml.BaseLoader):
+    def stringifyJSONScalars(data):
+        if isinstance(data, dict):
+            return {k: CopyTarget.stringifyJSONScalars(v)
+                    for k, v in data.items()}
+        if isinstance(data, list):
+            return [CopyTarget.stringifyJSONScalars(v) for v in data]
+        if data is None:
+            return "null"
+        if isinstance(data, bool):
+            return "true" if data else "false"
+        return data
+
+    @staticmethod
+    def orderedYAMLLoad(stream, Loader=BaseLoader):
 
         class OrderedLoader(Loader):
             pass
 
         def construct_mapping(loader, node):
-            return OrderedDict(loader.construct_pairs(node))
+            return dict(loader.construct_pairs(node))
 
         OrderedLoader.add_constructor(
             yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
             construct_mapping)
         return yaml.load(stream, OrderedLoader)
 
+    # Returns the st_mode of a path without following symlinks, or None if
+    # the path does not exist
+    @staticmethod
+    def lstatMode(path):
+        try:
+            return os.lstat(path).st_mode
+        except OSError:
+            return None
+
+    # Returns the absolute parent directory of a path. Destinations are
+    # already normalized and absolute, so for those this is string work
+    # only; anything else still goes through abspath() (and getcwd()).
+    @staticmethod
+    def parentDir(path):
+        path = path.rstrip("/") or "/"
+        if path.startswith("/") and "/." not in path and "//" not in path:
+            return os.path.dirname(path)
+        return os.path.abspath(os.path.join(path, os.pardir))
+
+    # Converts an octal permission from the CFG (e.g. "755") to an int. Only
+    # a handful of distinct permissions are used, so the results are cached
+    @staticmethod
+    @functools.lru_cache(maxsize=512)
+    def octalPerm(perm):
+        return int(str(perm), 8)
+
     @staticmethod
     def error(string, code=1):
         print("Error: " + string, file=sys.stderr)
@@ -596,7 +684,25 @@ class CopyTarget:
 # CopyTarget implementation specific for Linux Target
 class LinuxCopyTarget(CopyTarget):
 
-    # Recursively create missing directories and set ownership and permission
+    def __init__(self, targetDirectory, workspace, uidMapFile, gidMapFile,
+                 sourceType=None, filesystemType=None, allOptions=None,
+                 args=None):
+        super().__init__(targetDirectory, workspace, uidMapFile, gidMapFile,
+                         sourceType, filesystemType, allOptions, args)
+        self.knownParentDirs = set()
+        self.jobs = DEFAULT["jobs"]
+        try:
+            self.jobs = max(1, allOptions.jobs)
+        except AttributeError as e:
+            pass
+        # With more than one job, file contents are copied by a thread pool.
+        # Everything else is still done in order by the main thread.
+        self.copyPool = None
+        if self.jobs > 1:
+            self.copyPool = ThreadPoolExecutor(max_workers=self.jobs)
+        self.pendingCopies = deque()
+
+    # Create missing directories and set ownership and permission
     # This function can also be used to change permission of an already
     # existing file/directory
     def makedirs(self, destination, uid, gid, perm, isLeafNode="True"):
@@ -607,15 +713,124 @@ class LinuxCopyTarget(CopyTarget):
                 if not os.path.islink(destination):
                     os.chmod(destination, perm)
             return
+        # Collect the missing directories up to the first existing ancestor
+        # and create them top-down
+        missing = [destination]
+        parent = CopyTarget.parentDir(destination)
+        while parent not in self.knownParentDirs and \
+                not os.path.lexists(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        for i in reversed(range(len(missing))):
+            if i or not isLeafNode:
+                print("--> MKDIR PARENT '%s'" % missing[i])
+            os.mkdir(missing[i])
+            if self.doChown:
+                os.chown(missing[i], uid, gid)
+            os.chmod(missing[i], perm)
+            # Later items under the same tree skip the existence checks
+            self.knownParentDirs.add(missing[i].rstrip("/") or "/")
+
+    # Remove a file or a whole directory tree, printing each removed path
+    # like "rm -rfv" does. Missing paths are ignored.
+    def removePath(self, path, isDir=None):
+        if isDir is None:
+            try:
+                isDir = stat.S_ISDIR(os.lstat(path).st_mode)
+            except FileNotFoundError:
+                return
+        if isDir:
+            with os.scandir(path) as entries:
+                children = [(os.path.join(path, entry.name),
+                             entry.is_dir(follow_symlinks=False))
+                            for entry in entries]
+            for child, childIsDir in children:
+                self.removePath(child, childIsDir)
+            os.rmdir(path)
+            print("removed directory '%s'" % path)
         else:
-            parent = os.path.abspath(os.path.join(destination, os.pardir))
-            self.makedirs(parent, uid, gid, perm, False)
-        if not isLeafNode:
-            print("--> MKDIR PARENT '%s'" % destination)
-        os.mkdir(destination)
+            os.unlink(path)
+            print("removed '%s'" % path)
+
+    # Copy the contents of a regular file with copy_file_range() so the
+    # data never passes through user space (and is reflinked on file
+    # systems that support it). Anything else, or a kernel/file system that
+    # cannot do it, is left to shutil.copyfile().
+    # The ownership (a (uid, gid) tuple) and permission, when given, are set
+    # through the open descriptor of a regular file instead of walking the
+    # path again. Returns whether that was done.
+    @staticmethod
+    def fastcopy(source, destination, owner=None, perm=None):
+        sourceMode = CopyTarget.lstatMode(source)
+        if not hasattr(os, "copy_file_range") or sourceMode is None or \
+                not stat.S_ISREG(sourceMode):
+            shutil.copyfile(source, destination, follow_symlinks=False)
+            return False
+        with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+            try:
+                while os.copy_file_range(fsrc.fileno(), fdst.fileno(),
+                                         1 << 30):
+                    pass
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                   errno.EOPNOTSUPP):
+                    raise
+                # Both file offsets have advanced past whatever was copied
+                shutil.copyfileobj(fsrc, fdst)
+                fdst.flush()
+            if owner is not None:
+                os.fchown(fdst.fileno(), *owner)
+            if perm is not None:
+                os.fchmod(fdst.fileno(), perm)
+        return True
+
+    # Copy a file and set its ownership and permission. This may run on a
+    # worker thread, so it must not touch any shared state.
+    def _copyFile(self, source, destination, uid, gid, perm):
+        try:
+            if self.fastcopy(source, destination,
+                             (uid, gid) if self.doChown else None, perm):
+                return
+        except IsADirectoryError as e:
+            traceback.print_exc()
+            if source in str(e):
+                print("Error: CopyTarget does not allow directory to "
+                      "directory copy. Please itemize the files to "
+                      "copy.", file=sys.stderr)
+            elif destination in str(e):
+                print("Error: CopyTarget does not allow destination "
+                      "to be a directory. Please specify complete "
+                      "file name.", file=sys.stderr)
+            sys.exit(1)
         if self.doChown:
-            os.chown(destination, uid, gid)
-        os.chmod(destination, perm)
+            os.chown(destination, uid, gid, follow_symlinks=False)
+        if not os.path.islink(destination):
+            os.chmod(destination, perm)
+
+    # Record the size and digest of a copied file
+    def recordCopy(self, source, destination, uid, gid, perm, module):
+        self.recordFileSize.addFile(source, destination, module)
+        self.digestMetadata.addDigestEntry(self, source, destination, uid,
+                                           gid, perm)
+
+    # Wait for pending copies, oldest first, until at most "pending" remain
+    def finishFileItems(self, pending=0):
+        while len(self.pendingCopies) > pending:
+            future, copyArgs, module = self.pendingCopies.popleft()
+            try:
+                future.result()
+            except BaseException:
+                print("Error: Failed to copy '%s' to '%s'"
+                      % copyArgs[:2], file=sys.stderr)
+                raise
+            self.recordCopy(*copyArgs, module)
+
+    # Release the copy threads once all CFG files have been processed
+    def shutdown(self):
+        self.finishFileItems()
+        if self.copyPool is not None:
+            self.copyPool.shutdown()
+            self.copyPool = None
 
     # Copy each item in the CFG file from source to target
     def processFileItem(self, item, pos):
@@ -652,7 +867,12 @@ class LinuxCopyTarget(CopyTarget):
             # Otherwise, print a warning and automatically create all missing
             # directories.
             parent_dir = os.path.dirname(destination)
-            if not os.path.exists(parent_dir):
+            if parent_dir not in self.knownParentDirs:
+                # A pending copy may be what creates the parent (e.g. a
+                # symlink to a directory)
+                self.finishFileItems()
+            if parent_dir not in self.knownParentDirs and \
+                    not os.path.exists(parent_dir):
                 if not self.autocreateParentDir:
                     print("Error: Parent directory '%s' does not "
                           "exist." % (parent_dir), file=sys.stderr)
@@ -663,12 +883,20 @@ class LinuxCopyTarget(CopyTarget):
                       "Permission has been set to %d. "
                       "(uid='%d', gid='%d', perm='%d')."
                       "\033[0m" % (parent_dir, 755, uid, gid, 755))
-                self.makedirs(parent_dir, uid, gid, int("755", 8), False)
-            if os.path.lexists(destination) and \
-                    (not os.path.isdir(destination) or
-                     os.path.islink(destination)):
+                self.makedirs(parent_dir, uid, gid, 0o755, False)
+            # Most items share a few parent directories; remember the ones
+            # known to exist so they are not checked again
+            self.knownParentDirs.add(parent_dir)
+            # Replace anything but a real directory (one lstat instead of
+            # lexists + isdir + islink)
+            destinationMode = CopyTarget.lstatMode(destination)
+            if destinationMode is not None and \
+                    not stat.S_ISDIR(destinationMode):
                 os.remove(destination)
+                self.knownParentDirs.discard(destination)
             if create_symlink:
+                # Keep the size and digest records in manifest order
+                self.finishFileItems()
                 os.symlink(source, destination)
                 self.recordFileSize.addFile(None, destination, module,
                                             os.lstat(destination).st_size)
@@ -677,48 +905,49 @@ class LinuxCopyTarget(CopyTarget):
                 if self.doChown:
                     os.chown(destination, uid, gid, follow_symlinks=False)
             else:
-                try:
-                    shutil.copyfile(source, destination, follow_symlinks=False)
-                    self.recordFileSize.addFile(source, destination, module)
-                    perm = int(str(self.getValueFromDict(item, "perm")), 8)
-                    self.digestMetadata.addDigestEntry(self, source,
-                                                       destination, uid,
-                                                       gid, perm)
-                except IsADirectoryError as e:
-                    traceback.print_exc()
-                    if source in str(e):
-                        print("Error: CopyTarget does not allow directory to "
-                              "directory copy. Please itemize the files to "
-                              "copy.", file=sys.stderr)
-                    elif destination in str(e):
-                        print("Error: CopyTarget does not allow destination "
-                              "to be a directory. Please specify complete "
-                              "file name.", file=sys.stderr)
-                    sys.exit(1)
-                if self.doChown:
-                    os.chown(destination, uid, gid, follow_symlinks=False)
-                if not os.path.islink(destination):
-                    perm = int(str(self.getValueFromDict(item, "perm")), 8)
-                    os.chmod(destination, perm)
+                perm = CopyTarget.octalPerm(
+                    self.getValueFromDict(item, "perm"))
+                copyArgs = (source, destination, uid, gid, perm)
+                if self.copyPool is None:
+                    self._copyFile(*copyArgs)
+                    self.recordCopy(*copyArgs, module)
+                else:
+                    self.pendingCopies.append((self.copyPool.submit(
+                        self._copyFile, *copyArgs), copyArgs, module))
+                    # Bound the number of copies in flight
+                    if len(self.pendingCopies) > self.jobs * 4:
+                        self.finishFileItems(self.jobs * 2)
         elif remove:
+            # The removed files may be pending copies
+            self.finishFileItems()
             # User wants to remove files if "remove" key is set to true in CFG
             # (and "source" is not defined)
             print("[REMOVE] '%s'" % (destination))
             # Remove files specified in CFG from ${targetdir}/
-            self.executeCommand("rm -rfv " + destination)
+            # Wildcards are expanded like the shell used to do
+            for path in sorted(glob.glob(destination)) or [destination]:
+                self.removePath(path)
+            # The removed tree may contain directories known to exist
+            self.knownParentDirs.clear()
             module = self.getValueFromDict(item, "module")
             self.recordFileSize.removeFile(destination, module)
         else:
+            # The directory may be the parent of pending copies
+            self.finishFileItems()
             # Assume that user wants to create a directory or change the
             # permission of an already existing file/directory if "source"
             # is not defined.
-            if not os.path.lexists(destination):
+            destinationMode = CopyTarget.lstatMode(destination)
+            isLink = destinationMode is not None and \
+                stat.S_ISLNK(destinationMode)
+            if destinationMode is None:
                 print("[MKDIR] '%s'" % (destination))
             else:
                 print("[CHANGE METADATA] '%s'" % (destination))
             # Error out if the target directory does not have a trailing slash
-            if ((not os.path.lexists(destination)
-                 or os.path.isdir(destination)) and destination[-1:] != "/"):
+            if (destinationMode is None or stat.S_ISDIR(destinationMode)
+                    or (isLink and os.path.isdir(destination))) and \
+                    destination[-1:] != "/":
                 print("Error: Directory entries must end with a trailing "
                       "slash.", file=sys.stderr)
                 sys.exit(1)
@@ -726,12 +955,14 @@ class LinuxCopyTarget(CopyTarget):
             # user has selected the appropriate option.
             # Otherwise, print a warning and automatically create all missing
             # directories.
-            parent_dir = os.path.abspath(os.path.join(destination, os.pardir))
-            if not os.path.islink(destination):
-                perm = int(str(self.getValueFromDict(item, "perm")), 8)
+            parent_dir = CopyTarget.parentDir(destination)
+            if not isLink:
+                perm = CopyTarget.octalPerm(
+                    self.getValueFromDict(item, "perm"))
             else:
                 perm = None
-            if not os.path.exists(parent_dir):
+            if parent_dir not in self.knownParentDirs and \
+                    not os.path.exists(parent_dir):
                 if not self.autocreateParentDir:
                     print("Error: Parent directory '%s' does not "
                           "exist." % (parent_dir), file=sys.stderr)
@@ -743,6 +974,10 @@ class LinuxCopyTarget(CopyTarget):
                       % (parent_dir, uid, gid,
                          self.getValueFromDict(item, "perm")))
             self.makedirs(destination, uid, gid, perm)
+            # Both the directory and its parent exist now
+            self.knownParentDirs.add(parent_dir)
+            if not isLink:
+                self.knownParentDirs.add(destination.rstrip("/") or "/")
 
 
 # CopyTarget implementation specific to QNX
@@ -761,9 +996,9 @@ class QNXCopyTarget(CopyTarget):
             print("Error: The target directory has to be set to \"/\" while "
                   "creating QNX build files", file=sys.stderr)
             sys.exit(1)
-        self.directoriesCreated = []
+        self.directoriesCreated = set()
         self.outputBuildFile = allOptions.QNXBuildFile
-        self.outputBuffer = ""
+        self.outputBufferChunks = []
         self.outputHeaderFiles = allOptions.QNXBFHeaderFiles
 
     def expandSourcePath(self, path):
@@ -771,6 +1006,8 @@ class QNXCopyTarget(CopyTarget):
                     self.workspace + CopyTarget.expandvars(
                         path, self.exports)).strip()
 
+    # The buildfile writers below expect "destination" (and the "source" of
+    # a symlink) to be normalized already, as processFileItem does
     def copyfile(self, source, destination, uid, gid, perm, raw):
         # Check if parent directory has been created
         if not self.autocreateParentDir:
@@ -781,15 +1018,15 @@ class QNXCopyTarget(CopyTarget):
                       "exist." % (parent_dir), file=sys.stderr)
                 sys.exit(1)
         if not raw:
-            self.outputBuffer += (
+            self.outputBufferChunks.append((
                 "[uid={} gid={} perms={}]\t\t\t{} = {}\n").format(
-                    uid, gid, perm, CopyTarget.normpath(destination),
-                    CopyTarget.normpath(source))
+                    uid, gid, perm, destination,
+                    CopyTarget.normpath(source)))
         else:
-            self.outputBuffer += (
+            self.outputBufferChunks.append((
                 "[+raw uid={} gid={} perms={}]\t\t\t{} = {}\n").format(
-                    uid, gid, perm, CopyTarget.normpath(destination),
-                    CopyTarget.normpath(source))
+                    uid, gid, perm, destination,
+                    CopyTarget.normpath(source)))
 
     def symlink(self, source, destination, uid, gid, perm):
         # Check if parent directory has been created
@@ -801,30 +1038,28 @@ class QNXCopyTarget(CopyTarget):
                       "exist." % (parent_dir), file=sys.stderr)
                 sys.exit(1)
         if perm is None:
-            self.outputBuffer += (
+            self.outputBufferChunks.append((
                 "[type=link uid={} gid={}]\t\t\t{} = {}\n").format(
-                    uid, gid, CopyTarget.normpath(destination),
-                    CopyTarget.normpath(source))
+                    uid, gid, destination, source))
         else:
-            self.outputBuffer += (
+            self.outputBufferChunks.append((
                 "[type=link uid={} gid={} perms={}]\t{} = {}\n").format(
-                    uid, gid, perm, CopyTarget.normpath(destination),
-                    CopyTarget.normpath(source))
+                    uid, gid, perm, destination, source))
 
     def makedir(self, destination, uid, gid, perm):
         # Check if parent directory has been created
-        self.directoriesCreated.append(CopyTarget.normpath(destination))
+        self.directoriesCreated.add(destination)
         if not self.autocreateParentDir:
             parent_dir = CopyTarget.normpath(
-                os.path.abspath(os.path.join(destination, os.pardir)) + "/")
+                CopyTarget.parentDir(destination) + "/")
             if parent_dir not in self.directoriesCreated:
                 print("Error: Parent directory '%s' does not "
                       "exist." % (parent_dir), file=sys.stderr)
                 sys.exit(1)
 
-        self.outputBuffer += (
+        self.outputBufferChunks.append((
             "[type=dir uid={} gid={} dperms={}]\t{}\n").format(
-                uid, gid, perm, CopyTarget.normpath(destination))
+                uid, gid, perm, destination))
 
     # Copy each item in the CFG file from source to target
     def processFileItem(self, item, pos):
@@ -894,7 +1129,7 @@ class QNXCopyTarget(CopyTarget):
                 with open(hf, 'r', encoding='utf-8') as h:
                     f.write(h.read())
                 f.write('\n')
-            f.write(self.outputBuffer)
+            f.writelines(self.outputBufferChunks)
 
 
 class VerificationError(Exception):
@@ -918,7 +1153,7 @@ class FindRestrictedSourceFiles():
         self.whitelistYAMLManifestFile = None
         if options.whitelistYAMLManifestFile is not None:
             self.whitelistYAMLManifestFile = options.whitelistYAMLManifestFile
-            self.whitelistManifestFileList = []
+            self.whitelistManifestFileList = set()
             for copytargetCFG in args[2:]:
                 self.violationFileList[copytargetCFG]["whitelist"] = []
 
@@ -929,7 +1164,7 @@ class FindRestrictedSourceFiles():
                       "r", encoding='utf-8') as blacklistYAMLManifestHandle:
                 blacklistManifestDict = yaml.load(
                     blacklistYAMLManifestHandle,
-                    Loader=yaml.BaseLoader)
+                    Loader=BaseLoader)
             for fileItem in blacklistManifestDict["fileList"]:
                 file = CopyTarget.normpath(
                     self.workspace + CopyTarget.expandvars(fileItem["source"]))
@@ -948,11 +1183,11 @@ class FindRestrictedSourceFiles():
                       "r", encoding='utf-8') as whitelistYAMLManifestHandle:
                 whitelistManifestDict = yaml.load(
                     whitelistYAMLManifestHandle,
-                    Loader=yaml.BaseLoader)
+                    Loader=BaseLoader)
             for fileItem in whitelistManifestDict["fileList"]:
                 file = CopyTarget.normpath(
                     self.workspace + CopyTarget.expandvars(fileItem["source"]))
-                self.whitelistManifestFileList.append(file)
+                self.whitelistManifestFileList.add(file)
 
     def processFileItem(self, copytargetCFG, item, pos):
         source = CopyTarget.getValueFromDict(None, item, "source", False)
@@ -1039,7 +1274,7 @@ class FileSizeRecords:
             with open(self.targetSizeFile, "r",
                       encoding='utf-8') as targetSizeFileHandle:
                 self.fileSizeDict = self.orderedYAMLLoad(
-                    targetSizeFileHandle, Loader=yaml.SafeLoader)
+                    targetSizeFileHandle, Loader=SafeLoader)
         except FileNotFoundError as e:
             pass
 
@@ -1075,12 +1310,14 @@ class FileSizeRecords:
             self.fileSizeDict["modules"][module]["files"] = OrderedDict()
 
         if size is None:
-            if os.path.isdir(source) and (not os.path.islink(source)):
+            # One lstat() gives both the type and the size
+            sourceStat = os.lstat(source)
+            if stat.S_ISDIR(sourceStat.st_mode):
                 print("Error: {} is a directory. addFile() function "
                       "in FileSizeRecords can only accept files."
                       .format(source), file=sys.stderr)
                 sys.exit(1)
-            size = os.lstat(source).st_size
+            size = sourceStat.st_size
 
         if destination in self.fileRecordsDict:
             # Handle the case where the same file is added again to the FS
@@ -1129,21 +1366,23 @@ class FileSizeRecords:
                                  targetSizeFileHandle,
                                  default_flow_style=False, indent=4)
 
-    def orderedYAMLDump(self, data, stream=None, Dumper=yaml.SafeDumper,
+    def orderedYAMLDump(self, data, stream=None, Dumper=SafeDumper,
                         **kwds):
 
         class OrderedDumper(Dumper):
             pass
 
-        OrderedDumper.add_representer(
-            OrderedDict,
-            lambda dumper, data:
-                dumper.represent_mapping(
-                    yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
-                    data.items()))
+        # Plain dicts are insertion ordered as well, so neither is sorted
+        for mappingType in (OrderedDict, dict):
+            OrderedDumper.add_representer(
+                mappingType,
+                lambda dumper, data:
+                    dumper.represent_mapping(
+                        yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
+                        data.items()))
         return yaml.dump(data, stream, OrderedDumper, **kwds)
 
-    def orderedYAMLLoad(self, stream, Loader=yaml.SafeLoader):
+    def orderedYAMLLoad(self, stream, Loader=SafeLoader):
 
         class OrderedLoader(Loader):
             pass
@@ -1169,6 +1408,8 @@ class CopyTargetDigestMetadata:
         "ARRAY_LENGTH": 4,  # bytes
         "DIGEST": 64  # bytes
     }
+    # uid, gid, perm and file_type fields of a metadata file
+    HEADER = struct.Struct(">IIHB")
 
     def __init__(self, digestMetadataConfigJSON, mountPoint=None):
         self.enabled = False
@@ -1198,6 +1439,8 @@ class CopyTargetDigestMetadata:
             sys.exit(1)
         self.mountPoint = mountPoint
         self.metadataFileListDict = OrderedDict()
+        # Host directories of metadata files that are known to exist
+        self.metadataDirectories = set()
         self._initialize()
 
     def dictToGoldenDigestFile(self, goldenDigestFile, dict):
@@ -1236,29 +1479,34 @@ class CopyTargetDigestMetadata:
         #                        Stores the SHA512 SUM of metadata file
         # ---------------------------------------------------------------------
 
-        # mount_path_length
-        buffer = "COPYTARGET".encode("utf-8")
-        # mount_path
-        buffer += (self.mountPoint.encode("utf-8") + b'\x00').ljust(
-            CopyTargetDigestMetadata.SIZE["MOUNTPATH_LENGTH"], b'\x00')
-        # auth_block_size
-        buffer += self.authBlockSize.to_bytes(
-            CopyTargetDigestMetadata.SIZE["VALUE"], byteorder='big')
-        # digest_array_length
-        buffer += len(
-            self.metadataFileListDict).to_bytes(
-                CopyTargetDigestMetadata.SIZE["ARRAY_LENGTH"], byteorder='big')
-        # digests
-        for name, digest in self.metadataFileListDict.items():
-            # name
-            buffer += (name.encode("utf-8") + b'\x00').ljust(
-                CopyTargetDigestMetadata.SIZE["NAME_LENGTH"], b'\x00')
-            # digest
-            buffer += int(digest, 16).to_bytes(
-                CopyTargetDigestMetadata.SIZE["DIGEST"], byteorder='big')
+        # Records are streamed to the file as they are produced so that the
+        # blob is never held in memory as a whole
+        # Names are padded from a shared zero buffer instead of building a
+        # new padded bytes object for every record
+        padding = memoryview(
+            bytes(CopyTargetDigestMetadata.SIZE["NAME_LENGTH"]))
         os.makedirs(os.path.dirname(goldenDigestFile), exist_ok=True)
-        with open(goldenDigestFile, "wb") as f:
-            f.write(buffer)
+        with open(goldenDigestFile, "wb", buffering=1 << 20) as f:
+            # magic
+            f.write("COPYTARGET".encode("utf-8"))
+            # mount_path
+            f.write((self.mountPoint.encode("utf-8") + b'\x00').ljust(
+                CopyTargetDigestMetadata.SIZE["MOUNTPATH_LENGTH"], b'\x00'))
+            # auth_block_size
+            f.write(self.authBlockSize.to_bytes(
+                CopyTargetDigestMetadata.SIZE["VALUE"], byteorder='big'))
+            # digest_array_length
+            f.write(len(self.metadataFileListDict).to_bytes(
+                CopyTargetDigestMetadata.SIZE["ARRAY_LENGTH"],
+                byteorder='big'))
+            # digests
+            for name, digest in self.metadataFileListDict.items():
+                # name
+                name = name.encode("utf-8")
+                f.write(name)
+                f.write(padding[len(name):] or b'\x00')
+                # digest
+                f.write(bytes.fromhex(digest))
 
     def goldenDigestFileToDict(self, goldenDigestFile):
         dict = OrderedDict()
@@ -1292,14 +1540,18 @@ class CopyTargetDigestMetadata:
             digest_array_length = int.from_bytes(
                 f.read(CopyTargetDigestMetadata.SIZE["ARRAY_LENGTH"]),
                 byteorder='big')
-            for digest in range(digest_array_length):
-                metadataFile = f.read(
-                    CopyTargetDigestMetadata.SIZE["NAME_LENGTH"]).decode(
-                        "utf-8").split("\x00")[0]
-                metadataFileDigest = '{:x}'.format(
-                    int.from_bytes(
-                        f.read(CopyTargetDigestMetadata.SIZE["DIGEST"]),
-                        byteorder="big"))
+            # Read all records at once and slice the fields out of them
+            nameLength = CopyTargetDigestMetadata.SIZE["NAME_LENGTH"]
+            recordLength = nameLength + CopyTargetDigestMetadata.SIZE["DIGEST"]
+            records = f.read(digest_array_length * recordLength)
+            for offset in range(0, digest_array_length * recordLength,
+                                recordLength):
+                nameEnd = records.find(b"\x00", offset, offset + nameLength)
+                if nameEnd < 0:
+                    nameEnd = offset + nameLength
+                metadataFile = records[offset:nameEnd].decode("utf-8")
+                metadataFileDigest = records[
+                    offset + nameLength:offset + recordLength].hex()
                 dict[metadataFile] = metadataFileDigest
         return dict
 
@@ -1318,7 +1570,6 @@ class CopyTargetDigestMetadata:
                 destination) + "/" + metadataFileName)
         metadataFilePathTarget = os.path.join(os.path.dirname(destination),
                                               metadataFileName)
-        os.makedirs(self.metadataFileDirectory, exist_ok=True)
 
         # Handle cases where a symlink is being copied
         if not symlink:
@@ -1357,37 +1608,45 @@ class CopyTargetDigestMetadata:
         #    #endif
         # ---------------------------------------------------------------------
 
-        # uid
-        buffer = uid.to_bytes(
-            CopyTargetDigestMetadata.SIZE["VALUE"], byteorder='big')
-        # gid
-        buffer += gid.to_bytes(
-            CopyTargetDigestMetadata.SIZE["VALUE"], byteorder='big')
-        # perm
-        buffer += int(perm, 8).to_bytes(
-            CopyTargetDigestMetadata.SIZE["PERM"], byteorder='big')
+        # The size of the metadata is known up front, so it is filled into a
+        # single zeroed buffer instead of growing a bytes object field by
+        # field
+        header = CopyTargetDigestMetadata.HEADER
         if symlink:
-            # file_type (set 1 for symlink)
-            buffer += (1).to_bytes(1, byteorder='big')
             # symlink target_name (source)
-            buffer += (source.encode("utf-8") + b'\x00').ljust(
-                CopyTargetDigestMetadata.SIZE["NAME_LENGTH"], b'\x00')
+            targetName = source.encode("utf-8")
+            buffer = bytearray(header.size + max(
+                CopyTargetDigestMetadata.SIZE["NAME_LENGTH"],
+                len(targetName) + 1))
+            # uid, gid, perm, file_type (set 1 for symlink)
+            header.pack_into(buffer, 0, uid, gid, int(perm, 8), 1)
+            buffer[header.size:header.size + len(targetName)] = targetName
         else:
-            fileBlockDigests = []
-            self._getSHA_512(source, blockSize=self.authBlockSize,
-                             digestArray=fileBlockDigests)
-            # file_type (for now, set 0 for all other types of file)
-            buffer += (0).to_bytes(1, byteorder='big')
+            fileBlockDigests = self._getBlockSHA_512(source,
+                                                     self.authBlockSize)
+            digestLength = CopyTargetDigestMetadata.SIZE["DIGEST"]
+            offset = header.size + \
+                CopyTargetDigestMetadata.SIZE["ARRAY_LENGTH"]
+            buffer = bytearray(offset + digestLength * len(fileBlockDigests))
+            # uid, gid, perm, file_type (for now, set 0 for all other types
+            # of file)
+            header.pack_into(buffer, 0, uid, gid, int(perm, 8), 0)
             # digest_array_length
-            buffer += len(fileBlockDigests).to_bytes(
-                CopyTargetDigestMetadata.SIZE["ARRAY_LENGTH"], byteorder='big')
+            struct.pack_into(">I", buffer, header.size, len(fileBlockDigests))
             # digest_array
-            for digest in fileBlockDigests:
-                buffer += int(digest, 16).to_bytes(
-                    CopyTargetDigestMetadata.SIZE["DIGEST"], byteorder='big')
-
-        os.makedirs(os.path.dirname(metadataFilePathHost), exist_ok=True)
-        with open(metadataFilePathHost, 'wb') as f:
+            buffer[offset:] = b"".join(fileBlockDigests)
+
+        # Most files share their directory with the previous ones; only
+        # create (and stat) each metadata directory once. This also creates
+        # metadataFileDirectory itself.
+        metadataDirectory = os.path.dirname(metadataFilePathHost)
+        if metadataDirectory not in self.metadataDirectories:
+            os.makedirs(metadataDirectory, exist_ok=True)
+            self.metadataDirectories.add(metadataDirectory)
+
+        # The metadata is complete in memory; write it with a single
+        # unbuffered write() instead of copying it through BufferedWriter
+        with open(metadataFilePathHost, 'wb', buffering=0) as f:
             f.write(buffer)
 
         copytargetContext.copyfile(os.path.abspath(metadataFilePathHost),
@@ -1399,17 +1658,68 @@ class CopyTargetDigestMetadata:
             CopyTarget.normpath(metadataFilePathTarget)] = self._getSHA_512(
                 metadataFilePathHost)
 
-    def _getSHA_512(self, path, blockSize=8192, digestArray=None):
-        hash = hashlib.sha512()
-        if digestArray is not None:
-            digestArray.clear()
-        with open(path, "rb") as f:
-            for chunk in iter(lambda: f.read(blockSize), b''):
-                hash.update(chunk)
-                if digestArray is not None:
-                    digestArray.append(hashlib.sha512(chunk).hexdigest())
+    # Returns the SHA-512 of a whole file
+    def _getSHA_512(self, path):
+        with open(path, "rb", buffering=0) as f:
+            # Python 3.11+ reads the file into a preallocated buffer in C
+            if hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(f, "sha512").hexdigest()
+            hash = hashlib.sha512()
+            buffer = bytearray(1 << 20)
+            view = memoryview(buffer)
+            for size in iter(lambda: f.readinto(buffer), 0):
+                hash.update(view[:size])
         return hash.hexdigest()
 
+    # Returns the raw SHA-512 of the blocks of "view" in [start, end)
+    @staticmethod
+    def _hashBlocks(view, blockSize, start, end):
+        return [hashlib.sha512(view[offset:offset + blockSize]).digest()
+                for offset in range(start, end, blockSize)]
+
+    # Returns the raw (binary) SHA-512 of each "blockSize" block of a file
+    def _getBlockSHA_512(self, path, blockSize):
+        with open(path, "rb", buffering=0) as f:
+            # Map the file and hash the blocks straight from the page cache
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    if hasattr(data, "madvise"):
+                        data.madvise(mmap.MADV_SEQUENTIAL)
+                    with memoryview(data) as view:
+                        size = len(view)
+                        # hashlib releases the GIL while hashing, so the
+                        # blocks of large files are spread over threads in
+                        # batches of 64 to keep the dispatch cost low
+                        if size < 4 << 20 or (os.cpu_count() or 1) < 2:
+                            return self._hashBlocks(view, blockSize, 0, size)
+                        batch = 64 * blockSize
+                        starts = range(0, size, batch)
+                        ends = [min(start + batch, size) for start in starts]
+                        with ThreadPoolExecutor() as pool:
+                            batches = pool.map(
+                                functools.partial(self._hashBlocks, view,
+                                                  blockSize), starts, ends)
+                            return [digest for digests in batches
+                                    for digest in digests]
+            # Files that report no size (e.g. in /proc) are read instead:
+            # about 1 MiB (a whole number of blocks) per system call into a
+            # reused buffer, hashing the blocks from it without copying
+            digestArray = []
+            buffer = bytearray(max(1, (1 << 20) // blockSize) * blockSize)
+            view = memoryview(buffer)
+            while True:
+                size = 0
+                while size < len(buffer):
+                    read = f.readinto(view[size:])
+                    if not read:
+                        break
+                    size += read
+                digestArray += self._hashBlocks(view, blockSize, 0, size)
+                if size < len(buffer):
+                    break
+        return digestArray
+
     def writeGoldenDigestFile(self):
         if self.enabled in DOMAIN["negative_values"]:
             return
@@ -1431,13 +1741,24 @@ class CopyTargetSpreadsheet:
         self.workbook = None
         self.worksheet = None
         self.table = None
+        # Column elements of the table, indexed by column number
+        self.columns = []
         self.ns = {}
         self.fileListDict = OrderedDict()
         self.spreadsheetMetaDict = None
         self.metaSubstitutions = metaSubstitutions
+        # "{key}" (unless escaped) is replaced by the value of the key
+        self.metaSubstitutionPatterns = []
+        if metaSubstitutions is not None:
+            self.metaSubstitutionPatterns = [
+                (re.compile(r"(?<!\\){{{0}}}".format(key)), value)
+                for key, value in metaSubstitutions.items()]
         self.initialize()
 
+    # Cells and rows are created for every entry of every worksheet, so
+    # they use __slots__ instead of a per-instance __dict__
     class Cell:
+        __slots__ = ("data", "mergeAcross")
 
         def __init__(self, data, mergeAcross=0):
             self.data = data
@@ -1448,11 +1769,10 @@ class CopyTargetSpreadsheet:
                 self.mergeAcross = 0
 
     class Row:
+        __slots__ = ("cells", "isHeader")
 
         def __init__(self, *cells, isHeader=False):
-            self.cells = []
-            for cell in cells:
-                self.cells.append(cell)
+            self.cells = list(cells)
             self.isHeader = isHeader
 
         def appendCell(self, cell):
@@ -1462,38 +1782,49 @@ class CopyTargetSpreadsheet:
 
         @staticmethod
         def addFlattenedEntryToDict(key, value, dictionary, separator=":"):
-            if len(key.split(separator)) == 1 or key.split(separator)[1] == "":
-                dictionary[key.split(separator)[0]] = value
-                return
-            if key.split(separator)[0] not in dictionary:
-                dictionary[key.split(separator)[0]] = OrderedDict()
-            CopyTargetSpreadsheet.Utils.addFlattenedEntryToDict(
-                separator.join(key.split(separator)[1:]),
-                value, dictionary[key.split(separator)[0]], separator)
+            # Walk down the nested dicts instead of recursing on the
+            # re-joined remainder of the key
+            parts = key.split(separator)
+            for i, part in enumerate(parts):
+                if i + 1 == len(parts) or parts[i + 1] == "":
+                    dictionary[part] = value
+                    return
+                if part not in dictionary:
+                    dictionary[part] = OrderedDict()
+                dictionary = dictionary[part]
 
         @staticmethod
         def flattenDict(dictionary, parentKey="", seperator=":"):
+            # Depth-first walk with an explicit stack, so nested levels are
+            # not flattened into intermediate dicts first
             items = []
-            for key, value in dictionary.items():
-                if parentKey:
-                    newKey = parentKey + seperator + key
-                else:
-                    newKey = key
-                if isinstance(value, dict):
-                    items.extend(
-                        CopyTargetSpreadsheet.Utils.flattenDict(
-                            value, newKey, seperator).items())
-                else:
+            stack = [(parentKey, iter(dictionary.items()))]
+            while stack:
+                prefix, entries = stack[-1]
+                for key, value in entries:
+                    if prefix:
+                        newKey = prefix + seperator + key
+                    else:
+                        newKey = key
+                    if isinstance(value, dict):
+                        stack.append((newKey, iter(value.items())))
+                        break
                     items.append((newKey, value))
+                else:
+                    stack.pop()
             return OrderedDict(items)
 
         @staticmethod
         def insertItemToList(index, item, list, default=""):
-            for i in range(index + 1):
-                if i >= len(list):
-                    list.append(default)
-                if i == index:
-                    list[index] = item
+            if index >= len(list):
+                list.extend([default] * (index + 1 - len(list)))
+            list[index] = item
+
+    # Expand the meta substitutions used in a string of the metadata file
+    def substituteMeta(self, string):
+        for pattern, value in self.metaSubstitutionPatterns:
+            string = pattern.sub(value, string)
+        return string
 
     def initialize(self):
         # NoOp if a path to a spreadsheet is not provided by user
@@ -1504,7 +1835,7 @@ class CopyTargetSpreadsheet:
             with open(self.spreadsheetMeta, "r",
                       encoding='utf-8') as spreadsheetMetaHandle:
                 self.spreadsheetMetaDict = CopyTarget.orderedYAMLLoad(
-                    spreadsheetMetaHandle, Loader=yaml.BaseLoader)
+                    spreadsheetMetaHandle, Loader=BaseLoader)
             if "version" in self.spreadsheetMetaDict:
                 if self.spreadsheetMetaDict[
                         "version"] not in COMPATIBLE_MANIFEST_VERSIONS:
@@ -1603,13 +1934,14 @@ class CopyTargetSpreadsheet:
         # Worksheet has to be emptied before new data is added to it
         self.emptyWorksheet()
 
-        # Flatten fileListDict and add keys to flattenedHeaders[]
-        flattenedHeaders = []
-        for destination in self.fileListDict:
-            for key, value in CopyTargetSpreadsheet.Utils.flattenDict(
-                    self.fileListDict[destination]).items():
-                if key not in flattenedHeaders:
-                    flattenedHeaders.append(key)
+        # Flatten fileListDict (once; the rows are built from the same
+        # flattened entries) and add keys to flattenedHeaders[]
+        flattenedFileList = [
+            CopyTargetSpreadsheet.Utils.flattenDict(fileEntry)
+            for fileEntry in self.fileListDict.values()]
+        flattenedHeaders = list(dict.fromkeys(
+            key for flattenedDict in flattenedFileList
+            for key in flattenedDict))
 
         # Determine the ordering of columns based on meta YAML
         spreadsheetMetaDict = self.spreadsheetMetaDict
@@ -1617,15 +1949,10 @@ class CopyTargetSpreadsheet:
             # Print error if any blacklisted entry is present in the Meta File
             if "blacklist" in spreadsheetMetaDict["metadata"]:
                 for reEntry in spreadsheetMetaDict["metadata"]["blacklist"]:
-                    for key in self.metaSubstitutions:
-                        reEntry = re.sub(r"(?<!\\){{{0}}}".format(key),
-                                         self.metaSubstitutions[key], reEntry)
-                    matches = list(filter(
-                        re.compile("^" + reEntry + "$").match,
-                        flattenedHeaders))
-                    for item in matches:
-                        if item in flattenedHeaders:
-                            flattenedHeaders.remove(item)
+                    match = re.compile(
+                        "^" + self.substituteMeta(reEntry) + "$").match
+                    flattenedHeaders = [item for item in flattenedHeaders
+                                        if not match(item)]
 
             filteredFlattenedHeaders = []
             if "whitelist" in spreadsheetMetaDict["metadata"]:
@@ -1636,49 +1963,39 @@ class CopyTargetSpreadsheet:
                           "in '{}' has to be 'destination'"
                           .format(self.spreadsheetMeta), file=sys.stderr)
                     sys.exit(1)
+                whitelisted = set()
                 for reEntry in spreadsheetMetaDict["metadata"]["whitelist"]:
-                    for key in self.metaSubstitutions:
-                        reEntry = re.sub(r"(?<!\\){{{0}}}".format(key),
-                                         self.metaSubstitutions[key], reEntry)
-                    matches = list(filter(
-                        re.compile("^" + reEntry + "$").match,
-                        flattenedHeaders))
-                    for item in matches:
-                        if item not in filteredFlattenedHeaders:
+                    match = re.compile(
+                        "^" + self.substituteMeta(reEntry) + "$").match
+                    for item in flattenedHeaders:
+                        if item not in whitelisted and match(item):
+                            whitelisted.add(item)
                             filteredFlattenedHeaders.append(item)
             flattenedHeaders = filteredFlattenedHeaders
 
             # Read all overrides and expand any variables used in that
             if "overrides" in spreadsheetMetaDict["metadata"]:
-                for keyEntry in spreadsheetMetaDict["metadata"]["overrides"]:
-                    for key in self.metaSubstitutions:
-                        spreadsheetMetaDict[
-                            "metadata"]["overrides"][keyEntry] = re.sub(
-                                r"(?<!\\){{{0}}}".format(key),
-                                self.metaSubstitutions[key],
-                                spreadsheetMetaDict[
-                                    "metadata"]["overrides"][keyEntry])
+                overrides = spreadsheetMetaDict["metadata"]["overrides"]
+                for keyEntry in overrides:
+                    overrides[keyEntry] = self.substituteMeta(
+                        overrides[keyEntry])
 
             if "defaults" in spreadsheetMetaDict["metadata"]:
                 for keyEntry, item in spreadsheetMetaDict["metadata"][
                         "defaults"].copy().items():
-                    for key in self.metaSubstitutions:
-                        keyEntry = re.sub(r"(?<!\\){{{0}}}".format(key),
-                                          self.metaSubstitutions[key],
-                                          keyEntry)
-                        item = re.sub(r"(?<!\\){{{0}}}".format(key),
-                                      self.metaSubstitutions[key],
-                                      item)
+                    keyEntry = self.substituteMeta(keyEntry)
+                    item = self.substituteMeta(item)
                     spreadsheetMetaDict[
                         "metadata"]["defaults"][keyEntry] = item
 
         # Flatten fileListDict and add values to rows[]
+        # (columns are looked up by header instead of list.index())
+        headerIndex = {key: colNo
+                       for colNo, key in enumerate(flattenedHeaders)}
         rows = []
         maxRowLength = 0
-        for destination in self.fileListDict:
+        for flattenedDict in flattenedFileList:
             dataList = []
-            flattenedDict = CopyTargetSpreadsheet.Utils.flattenDict(
-                self.fileListDict[destination])
             for key, value in flattenedDict.items():
                 if spreadsheetMetaDict is not None and \
                         "overrides" in spreadsheetMetaDict["metadata"]:
@@ -1688,25 +2005,25 @@ class CopyTargetSpreadsheet:
                             value = flattenedDict[
                                 spreadsheetMetaDict[
                                     "metadata"]["overrides"][key]]
-                if key in flattenedHeaders:
+                if key in headerIndex:
                     CopyTargetSpreadsheet.Utils.insertItemToList(
-                        flattenedHeaders.index(key),
+                        headerIndex[key],
                         self.Cell(value), dataList, default=self.Cell(""))
             if spreadsheetMetaDict is not None and \
                     "defaults" in spreadsheetMetaDict["metadata"]:
                 for key, default in spreadsheetMetaDict[
                         "metadata"]["defaults"].items():
                     try:
-                        if key in flattenedHeaders and \
-                                not dataList[flattenedHeaders.index(key)].data:
+                        if key in headerIndex and \
+                                not dataList[headerIndex[key]].data:
                             CopyTargetSpreadsheet.Utils.insertItemToList(
-                                flattenedHeaders.index(key),
+                                headerIndex[key],
                                 self.Cell(default), dataList,
                                 default=self.Cell(""))
                     except IndexError as e:
-                        if key in flattenedHeaders:
+                        if key in headerIndex:
                             CopyTargetSpreadsheet.Utils.insertItemToList(
-                                flattenedHeaders.index(key),
+                                headerIndex[key],
                                 self.Cell(default), dataList,
                                 default=self.Cell(""))
             rows.append(dataList)
@@ -1723,19 +2040,21 @@ class CopyTargetSpreadsheet:
                         flattenedHeaders[i] = spreadsheetMetaDict[
                             "metadata"]["rename"][flattenedHeaders[i]]
 
-        # Extract headers from flattenedHeaders
+        # Extract headers from flattenedHeaders. Each header is split once;
+        # every header row takes the next segment of each column.
         headers = []
+        headerSegments = [data.split(":") for data in flattenedHeaders]
+        depth = [0] * len(headerSegments)
         while True:
-            colNo = 0
             header = []
             allEmpty = True
-            for data in flattenedHeaders:
-                if data.split(":")[0] != "":
+            for colNo, segments in enumerate(headerSegments):
+                if depth[colNo] < len(segments) and \
+                        segments[depth[colNo]] != "":
                     allEmpty = False
                     CopyTargetSpreadsheet.Utils.insertItemToList(
-                        colNo, data.split(":")[0], header)
-                    flattenedHeaders[colNo] = ":".join(data.split(":")[1:])
-                colNo += 1
+                        colNo, segments[depth[colNo]], header)
+                    depth[colNo] += 1
             if allEmpty:
                 break
             headers.append(header)
@@ -1848,6 +2167,19 @@ class CopyTargetSpreadsheet:
         for ns in namespaces:
             ET.register_namespace(ns, namespaces[ns])
             self.ns[ns] = "{" + namespaces[ns] + "}"
+        # Qualified names used for every row and cell
+        ss = self.ns["ss"]
+        self.ssRow = ss + "Row"
+        self.ssCell = ss + "Cell"
+        self.ssData = ss + "Data"
+        self.ssName = ss + "Name"
+        self.ssType = ss + "Type"
+        self.ssTable = ss + "Table"
+        self.ssWidth = ss + "Width"
+        self.ssColumn = ss + "Column"
+        self.ssStyleID = ss + "StyleID"
+        self.ssWorksheet = ss + "Worksheet"
+        self.ssMergeAcross = ss + "MergeAcross"
         if os.path.exists(self.spreadsheetFile):
             self.workbook = ET.parse(self.spreadsheetFile).getroot()
             appName = None
@@ -1870,9 +2202,8 @@ class CopyTargetSpreadsheet:
 
     def addWorksheet(self):
         worksheetName = self.worksheetName
-        self.worksheet = ET.SubElement(self.workbook,
-                                       self.ns["ss"] + "Worksheet")
-        self.worksheet.set(self.ns["ss"] + "Name", worksheetName)
+        self.worksheet = ET.SubElement(self.workbook, self.ssWorksheet)
+        self.worksheet.set(self.ssName, worksheetName)
 
         # Add WorksheetOptions to freeze header
         worksheetOptions = ET.SubElement(self.worksheet, "WorksheetOptions")
@@ -1884,82 +2215,95 @@ class CopyTargetSpreadsheet:
         ET.SubElement(worksheetOptions, "TopRowBottomPane").text = "0"
         ET.SubElement(worksheetOptions, "ActivePane").text = "2"
 
-        self.table = ET.SubElement(self.worksheet,
-                                   self.ns["ss"] + "Table")
+        self.table = ET.SubElement(self.worksheet, self.ssTable)
+        self.columns = []
 
     def adjustColumnWidth(self, colNo, width, force=False, maxWidth=400):
-        i = 0
-        for column in self.table.findall(self.ns["ss"] + "Column"):
-            if colNo == i:
-                currentWidth = column.get(self.ns["ss"] + "Width")
-                if maxWidth is not None and width > maxWidth:
-                    width = maxWidth
-                if float(currentWidth) < width or force is True:
-                    column.set(self.ns["ss"] + "Width", str(width))
-            i += 1
+        if colNo >= len(self.columns):
+            return
+        column = self.columns[colNo]
+        currentWidth = column.get(self.ssWidth)
+        if maxWidth is not None and width > maxWidth:
+            width = maxWidth
+        if float(currentWidth) < width or force is True:
+            column.set(self.ssWidth, str(width))
 
     def addRow(self, cells, isHeader=False):
         styleID = "text"
         if isHeader:
             styleID = "header"
-        if not self.table.findall(self.ns["ss"] + "Column"):
+        if not self.columns:
             for cell in cells:
                 mergeAcross = cell.mergeAcross
                 while mergeAcross >= 0:
                     column = ET.SubElement(self.table,
-                                           self.ns["ss"] + "Column")
-                    column.set(self.ns["ss"] + "Width", "40")
+                                           self.ssColumn)
+                    column.set(self.ssWidth, "40")
+                    self.columns.append(column)
                     mergeAcross = mergeAcross - 1
-        row = ET.SubElement(self.table, self.ns["ss"] + "Row")
+        row = ET.SubElement(self.table, self.ssRow)
         colNo = 0
         for cell in cells:
             mergeAcross = cell.mergeAcross
-            cellElement = ET.SubElement(row, self.ns["ss"] + "Cell")
-            cellElement.set(self.ns["ss"] + "MergeAcross", str(mergeAcross))
-            cellElement.set(self.ns["ss"] + "StyleID", styleID)
-            data = ET.SubElement(cellElement, self.ns["ss"] + "Data")
-            data.set(self.ns["ss"] + "Type", "String")
+            # Attributes are passed to SubElement() so that each element is
+            # created with its attribute dict in one call
+            cellElement = ET.SubElement(row, self.ssCell, {
+                self.ssMergeAcross: str(mergeAcross),
+                self.ssStyleID: styleID})
+            data = ET.SubElement(cellElement, self.ssData, {
+                self.ssType: "String"})
             data.text = cell.data
             self.adjustColumnWidth(colNo, len(cell.data) * 6)
             colNo = colNo + 1 + int(mergeAcross)
 
-    def deleteWorksheet(self):
+    # Return the first worksheet named worksheetName, or None
+    def findWorksheet(self):
         worksheetName = self.worksheetName
-        for worksheet in self.workbook.findall(self.ns["ss"] + 'Worksheet'):
-            if worksheet.get(self.ns["ss"] + "Name") == worksheetName:
-                break
-        if worksheet.get(self.ns["ss"] + "Name") != worksheetName:
+        ssName = self.ssName
+        for worksheet in self.workbook.iterfind(self.ssWorksheet):
+            if worksheet.get(ssName) == worksheetName:
+                return worksheet
+        return None
+
+    def deleteWorksheet(self):
+        worksheet = self.findWorksheet()
+        if worksheet is None:
             return
         self.workbook.remove(worksheet)
         self.worksheet = None
         self.table = None
+        self.columns = []
 
     def emptyWorksheet(self):
         self.deleteWorksheet()
         self.addWorksheet()
 
     def readWorksheet(self):
-        worksheetName = self.worksheetName
         worksheetData = []
-        if len(self.workbook.findall(self.ns["ss"] + 'Worksheet')) == 0:
-            return None
-        for worksheet in self.workbook.findall(self.ns["ss"] + 'Worksheet'):
-            if worksheet.get(self.ns["ss"] + "Name") == worksheetName:
-                break
-        if worksheet.get(self.ns["ss"] + "Name") != worksheetName:
+        worksheet = self.findWorksheet()
+        if worksheet is None:
             return None
-        table = worksheet.find(self.ns["ss"] + "Table")
-        rowNumber = 0
-        for row in table.findall(self.ns["ss"] + "Row"):
-            worksheetData.insert(rowNumber, self.Row())
-            for cell in row.findall(self.ns["ss"] + "Cell"):
-                if cell.get(self.ns["ss"] + "StyleID") == "header":
-                    worksheetData[rowNumber].isHeader = True
-                mergeAcross = cell.get(self.ns["ss"] + "MergeAcross")
-                data = cell.find(self.ns["ss"] + "Data").text
-                worksheetData[rowNumber].appendCell(self.Cell(data,
-                                                              mergeAcross))
-            rowNumber = rowNumber + 1
+        table = worksheet.find(self.ssTable)
+        # Bind the qualified names once, they are looked up for every cell
+        ssCell = self.ssCell
+        ssData = self.ssData
+        ssStyleID = self.ssStyleID
+        ssMergeAcross = self.ssMergeAcross
+        Row = self.Row
+        Cell = self.Cell
+        for row in table.iterfind(self.ssRow):
+            worksheetRow = Row()
+            for cell in row.iterfind(ssCell):
+                if cell.get(ssStyleID) == "header":
+                    worksheetRow.isHeader = True
+                # Only a handful of distinct MergeAcross values exist, so
+                # share one string per value across all cells
+                mergeAcross = cell.get(ssMergeAcross)
+                if mergeAcross is not None:
+                    mergeAcross = sys.intern(mergeAcross)
+                data = cell.find(ssData).text
+                worksheetRow.appendCell(Cell(data, mergeAcross))
+            worksheetData.append(worksheetRow)
         return worksheetData
 
     def writeSpreadsheet(self):
@@ -1967,8 +2311,11 @@ class CopyTargetSpreadsheet:
         xmlHeader = '''<?xml version="1.0"?>
         <?mso-application progid="Excel.Sheet"?>
         '''
+        # Serialize straight into the file instead of building the whole
+        # document as one bytes object first
         with open(output, "wb") as f:
-            f.write(bytes(xmlHeader, 'utf-8') + ET.tostring(self.workbook))
+            f.write(bytes(xmlHeader, 'utf-8'))
+            ET.ElementTree(self.workbook).write(f)
 
 
 def main():
@@ -2004,6 +2351,10 @@ def main():
                       "they have not been explicitly specified in the "
                       "manifest. Accepted values: 'True/yes', 'False/no'. "
                       "Default: '{}'".format(DEFAULT["autocreateParentDir"]))
+    parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                      default=DEFAULT["jobs"],
+                      help="Number of files copied in parallel. "
+                      "Default: {}".format(DEFAULT["jobs"]))
     parser.add_option("--no-chown", dest="noChown",
                       default=(not DEFAULT["doChown"]), action="store_true",
                       help="Do not change ownership of the files")
@@ -2099,6 +2450,7 @@ def main():
                                         options, args)
         for copytargetCFG in args[2:]:
             linuxTargetFS.processCFG(copytargetCFG)
+        linuxTargetFS.shutdown()
         linuxTargetFS.recordFileSize.writeTargetSizeManifest()
     else:
         QNXBuildFile = QNXCopyTarget(args[0], args[1],
@@ -1,4 +1,6 @@
 import os  
+import re  
+import mmap  
 import sys  
 
 # 检查参数个数  
@@ -21,22 +23,30 @@ if action not in ['n', 'y']:
     sys.exit(1)  
 
 # 定义替换逻辑  
-replace_dict = {'n': {'ENABLE_DRAM_ECC := y': 'ENABLE_DRAM_ECC := n'}, 'y': {'ENABLE_DRAM_ECC := n': 'ENABLE_DRAM_ECC := y'}}  
+replace_dict = {'n': {b'ENABLE_DRAM_ECC := y': b'ENABLE_DRAM_ECC := n'}, 'y': {b'ENABLE_DRAM_ECC := n': b'ENABLE_DRAM_ECC := y'}}  
 replacement_pairs = replace_dict[action]  
+# 所有待替换的字符串合并为一个正则，一次扫描完成全部替换  
+pattern = re.compile(b'|'.join(map(re.escape, replacement_pairs)))  
 
-# 尝试读取输入文件并替换内容  
+# 尝试读取输入文件并替换内容（按字节处理，省去文本解码）  
+changed = False  
 try:  
-    with open(input_file_path, 'r') as input_file:  
-        content = input_file.read()  
-        new_content = content  
-        for old, new in replacement_pairs.items():  
-            new_content = new_content.replace(old, new)  
-
-    # 如果替换成功，将内容写回原文件（如果需要可以指定新的输出文件）  
-    with open(input_file_path, 'w') as output_file:  
-        output_file.write(new_content)  
-
-    print(f'替换完成，结果已写回{input_file_path}')  
+    # 替换前后长度相同：通过 mmap 原地改写匹配处，不再整体读出和写回文件  
+    with open(input_file_path, 'r+b') as input_file:  
+        if os.fstat(input_file.fileno()).st_size > 0:  
+            with mmap.mmap(input_file.fileno(), 0) as mm:  
+                matches = [(m.start(), m.group(0)) for m in pattern.finditer(mm)]  
+                for start, old in matches:  
+                    mm[start:start + len(old)] = replacement_pairs[old]  
+                if matches:  
+                    mm.flush()  
+                    changed = True  
+
+    # 没有可替换的内容时不写文件，避免无谓地更新文件时间戳  
+    if changed:  
+        print(f'替换完成，结果已写回{input_file_path}')  
+    else:  
+        print(f'{input_file_path} 中没有需要替换的内容，文件未修改')  
 
 except IOError as e:  
     print(f"处理文件时发生错误：{e}")  